@@ -0,0 +1,52 @@
+# Memory benchmark of the records.py row types against the tuples the database driver returns
+# Run from the repository root: python benchmarks/row_memory_benchmark.py
+import os
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from records import Topic, Post
+
+# rows like the ones a cursor returns, every value a distinct object as it is after a fetch
+def topic_rows(n):
+	created = datetime(2020, 1, 1)
+	for i in range(n):
+		yield (i, 'topic name {}'.format(i), 'description of topic {}'.format(i), i % 100, created + timedelta(seconds=i), None)
+
+def post_rows(n):
+	created = datetime(2020, 1, 1)
+	for i in range(n):
+		yield (i, 'post number {}'.format(i), created + timedelta(seconds=i), i % 1000)
+
+# Function returning the bytes allocated by build(rows) that are still held by its result
+def measure(build, rows):
+	tracemalloc.start()
+	result = build(rows)
+	size = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	del result
+	return size
+
+# the same row repeated, so only the row objects themselves are allocated and not their values
+def repeated(rows, n):
+	row = next(rows)
+	for i in range(n):
+		yield tuple(list(row)) # a new tuple, tuple(row) would return row itself
+
+def report(label, as_tuples, as_records, n):
+	print('  {}'.format(label))
+	print('    tuples   {:8.1f} MB  {:5.1f} bytes/row'.format(as_tuples / 1e6, as_tuples / n))
+	print('    records  {:8.1f} MB  {:5.1f} bytes/row'.format(as_records / 1e6, as_records / n))
+	print('    saved    {:8.1f} MB  {:5.1f}%'.format((as_tuples - as_records) / 1e6, 100 * (as_tuples - as_records) / as_tuples))
+
+def main():
+	n = 1000000
+	for name, rows, record in (('topics', topic_rows, Topic), ('posts', post_rows, Post)):
+		build_records = lambda rows: [record(*row) for row in rows]
+		print('{} n={}'.format(name, n))
+		report('rows with their values', measure(list, rows(n)), measure(build_records, rows(n)), n)
+		report('row objects only', measure(list, repeated(rows(1), n)), measure(build_records, repeated(rows(1), n)), n)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,64 @@
+# Micro-benchmark of ranking.top_k against the selection loops it replaced
+# Run from the repository root: python benchmarks/topk_benchmark.py
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ranking import top_k
+
+# the old order_trending_topics loop: one full pass over the scores per selected topic
+def repeated_max_scan(scores, k):
+	scores = list(scores)
+	res = []
+	for i in range(k):
+		highest = 0
+		for j in range(len(scores)):
+			if scores[j] > scores[highest]:
+				highest = j
+		if scores[highest] <= 0:
+			break
+		res.append(highest)
+		scores[highest] = -1
+	return res
+
+# the old search_for loop: find the maximum, delete it from the list, repeat
+def max_scan_with_delete(scores, k):
+	scores = list(scores)
+	res = []
+	while len(scores) > 0 and len(res) < k:
+		highest = 0
+		for i in range(len(scores)):
+			if scores[i] > scores[highest]:
+				highest = i
+		if scores[highest] == 0:
+			break
+		res.append(scores[highest])
+		del scores[highest]
+	return res
+
+def timed(function, *args):
+	start = time.perf_counter()
+	function(*args)
+	return time.perf_counter() - start
+
+def main():
+	k = 20
+	for n in (10000, 1000000):
+		random.seed(n)
+		scores = [random.random() for i in range(n)]
+		indexed = list(enumerate(scores))
+
+		print('n={} k={}'.format(n, k))
+		print('  repeated max scan     {:.4f}s'.format(timed(repeated_max_scan, scores, k)))
+		print('  max scan with delete  {:.4f}s'.format(timed(max_scan_with_delete, scores, k)))
+		print('  top_k                 {:.4f}s'.format(timed(top_k, indexed, k, lambda pair: pair[1])))
+
+		# search_for used to rank every match, which is quadratic in the number of matches
+		if n <= 10000:
+			print('  full ranking, old     {:.4f}s'.format(timed(max_scan_with_delete, scores, n)))
+			print('  full ranking, top_k   {:.4f}s'.format(timed(top_k, indexed, None, lambda pair: pair[1])))
+
+if __name__ == '__main__':
+	main()
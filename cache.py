@@ -0,0 +1,201 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+# Returned by get() when a key is not cached, since None is a value worth caching (e.g. a missing topic)
+MISSING = object()
+
+# Hit and miss counters shared by the cache implementations
+class CacheStats:
+	def __init__(self):
+		self._lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+		self.invalidations = 0
+
+	def record(self, hit):
+		with self._lock:
+			if hit:
+				self.hits += 1
+			else:
+				self.misses += 1
+
+	def record_invalidation(self):
+		with self._lock:
+			self.invalidations += 1
+
+	def as_dict(self):
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {
+				'hits': self.hits,
+				'misses': self.misses,
+				'invalidations': self.invalidations,
+				'hit_rate': self.hits / lookups if lookups else 0.0,
+			}
+
+# Loads of missing keys in progress, see read_through
+# a key deleted while it loads may have been loaded from the rows the write replaced, so the value
+# of that load is not stored. Used by the caches with their lock held.
+class _Loads:
+	def __init__(self):
+		self._loads = {} # key -> [loads in progress, times the key was deleted since the first of them started]
+
+	# Function to register a load of key, returns the token to finish it with
+	def start(self, key):
+		load = self._loads.setdefault(key, [0, 0])
+		load[0] += 1
+		return load[1]
+
+	def deleted(self, key):
+		load = self._loads.get(key)
+		if load is not None:
+			load[1] += 1
+
+	# Function to unregister a load, returns True if key was not deleted since the load started
+	def finish(self, key, token):
+		load = self._loads[key]
+		load[0] -= 1
+		if load[0] == 0:
+			del self._loads[key]
+		return load[1] == token
+
+# In-process least recently used cache where every entry expires after ttl seconds
+class LRUCache:
+	def __init__(self, max_entries=1024, ttl=60):
+		self.max_entries = max_entries
+		self.ttl = ttl
+		self._entries = OrderedDict() # key -> (expiry time, value), least recently used first
+		self._loads = _Loads()
+		self._lock = threading.Lock()
+		self.stats = CacheStats()
+
+	def get(self, key):
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None and entry[0] <= time.monotonic():
+				del self._entries[key]
+				entry = None
+			if entry is not None:
+				self._entries.move_to_end(key)
+
+		self.stats.record(entry is not None)
+		return MISSING if entry is None else entry[1]
+
+	def set(self, key, value, ttl=None):
+		with self._lock:
+			self._set_locked(key, value, ttl)
+
+	def delete(self, key):
+		with self._lock:
+			self._entries.pop(key, None)
+			self._loads.deleted(key)
+		self.stats.record_invalidation()
+
+	# Function to register a load of a missing key, see read_through
+	def start_load(self, key):
+		with self._lock:
+			return self._loads.start(key)
+
+	# Function to store the value a load returned, unless the key was deleted while it loaded
+	# called without a value for a load that failed
+	def finish_load(self, key, token, value=MISSING, ttl=None):
+		with self._lock:
+			if self._loads.finish(key, token) and value is not MISSING:
+				self._set_locked(key, value, ttl)
+
+	def _set_locked(self, key, value, ttl):
+		expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+		self._entries[key] = (expires, value)
+		self._entries.move_to_end(key)
+		while len(self._entries) > self.max_entries:
+			self._entries.popitem(last=False)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+
+	def __len__(self):
+		return len(self._entries)
+
+# Cache kept in an external store shared by every instance of the app
+# client is anything with memcache style get(key), set(key, value, expire) and delete(key) methods
+# values are pickled, so the client only has to store bytes
+# A load is only kept from storing a stale value by deletes made through this instance, a delete
+# from another instance during the load is not seen and the value stays until ttl runs out
+class ExternalCache:
+	def __init__(self, client, ttl=60, prefix='message_board:'):
+		self._client = client
+		self.ttl = ttl
+		self.prefix = prefix
+		self._loads = _Loads()
+		self._lock = threading.Lock() # orders the deletes with the stores of loaded values
+		self.stats = CacheStats()
+
+	def get(self, key):
+		data = self._client.get(self.prefix + key)
+		self.stats.record(data is not None)
+		if data is None:
+			return MISSING
+		return pickle.loads(data)
+
+	def set(self, key, value, ttl=None):
+		self._client.set(self.prefix + key, pickle.dumps(value), int(self.ttl if ttl is None else ttl))
+
+	def delete(self, key):
+		with self._lock:
+			self._client.delete(self.prefix + key)
+			self._loads.deleted(key)
+		self.stats.record_invalidation()
+
+	# Function to register a load of a missing key, see read_through
+	def start_load(self, key):
+		with self._lock:
+			return self._loads.start(key)
+
+	# Function to store the value a load returned, unless the key was deleted while it loaded
+	# called without a value for a load that failed
+	def finish_load(self, key, token, value=MISSING, ttl=None):
+		with self._lock:
+			if self._loads.finish(key, token) and value is not MISSING:
+				self.set(key, value, ttl)
+
+# Local stand-in for an external store such as memcached, for development and load tests
+class FakeCacheClient:
+	def __init__(self):
+		self._data = {} # key -> (expiry time, bytes)
+		self._lock = threading.Lock()
+
+	def get(self, key):
+		with self._lock:
+			entry = self._data.get(key)
+			if entry is None:
+				return None
+			if entry[0] <= time.monotonic():
+				del self._data[key]
+				return None
+			return entry[1]
+
+	def set(self, key, value, expire=0):
+		with self._lock:
+			self._data[key] = (time.monotonic() + expire if expire else float('inf'), value)
+
+	def delete(self, key):
+		with self._lock:
+			self._data.pop(key, None)
+
+# Function to fetch a value through the cache, calling load() and caching its result on a miss
+# the result is not cached if the key is deleted while load() runs, a write committing meanwhile
+# would otherwise have its invalidation undone by the value read before it
+def read_through(cache, key, load, ttl=None):
+	value = cache.get(key)
+	if value is MISSING:
+		token = cache.start_load(key)
+		try:
+			value = load()
+		except Exception:
+			cache.finish_load(key, token)
+			raise
+		cache.finish_load(key, token, value, ttl)
+	return value
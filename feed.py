@@ -0,0 +1,40 @@
+from query_batch import QueryBatch
+
+# Builds a list of topics out of several ranked sources, e.g. trending and recently created topics
+# Sources are fetched concurrently, then taken whole one after another in order of priority, highest
+# first (sources with equal priority keep the order they were added in). A topic already taken from an
+# earlier source is skipped, so every topic appears once, and the list stops at limit topics.
+class TopicFeed:
+	def __init__(self, limit):
+		self.limit = limit
+		self._sources = [] # (priority, name, function, args, most topics taken from this source)
+
+	# Function to add a source, function(*args) must return Topic records, best first
+	def add_source(self, name, function, *args, priority=0, max_topics=None):
+		self._sources.append((priority, name, function, args, max_topics))
+		return self
+
+	# Function to fetch every source on the executor and merge them into the feed
+	def build(self, executor):
+		with QueryBatch(executor) as batch:
+			fetched = [(source, batch.submit(source[2], *source[3])) for source in self._sources]
+
+		# sorted is stable, so sources with the same priority stay in the order they were added
+		fetched.sort(key=lambda item: item[0][0], reverse=True)
+
+		feed = []
+		seen = set() # ids of the topics already in the feed
+		for (priority, name, function, args, max_topics), future in fetched:
+			taken = 0
+			for topic in future.result():
+				if len(feed) >= self.limit:
+					return feed
+				if max_topics is not None and taken >= max_topics:
+					break
+				if topic.id in seen:
+					continue
+				seen.add(topic.id)
+				feed.append(topic)
+				taken += 1
+
+		return feed
@@ -0,0 +1,171 @@
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from cache import CacheStats
+
+# Function estimating the bytes a record from records.py takes in memory, the object and its values
+def row_size(row):
+	return sys.getsizeof(row) + sum(sys.getsizeof(getattr(row, name)) for name in row.__slots__)
+
+# Topic held by the store, its row and a ring buffer of its newest posts
+class _HotTopic:
+	__slots__ = ('topic', 'posts', 'complete', 'loaded_at', 'size')
+
+	def __init__(self, topic, posts, complete, max_posts):
+		self.topic = topic
+		self.posts = deque(reversed(posts), maxlen=max_posts) # oldest first, new posts are appended on the right
+		self.complete = complete # True while the buffer holds every post of the topic
+		self.loaded_at = time.monotonic()
+		self.size = row_size(topic) + sum(row_size(post) for post in posts)
+
+	# Function to add a new post, keeping the posts in id order, returns the change in size
+	# transactions can commit out of id order, so a post is not always the newest one
+	def add(self, post, count_post):
+		posts = self.posts
+		position = len(posts)
+		while position and posts[position - 1].id >= post.id:
+			if posts[position - 1].id == post.id:
+				return 0 # already held, e.g. read by the load that raced with the write
+			position -= 1
+
+		size = self.size - row_size(self.topic)
+		self.topic = count_post(self.topic, post)
+		size += row_size(self.topic)
+
+		if position == 0 and len(posts) == posts.maxlen:
+			self.complete = False # older than every post held, so not among the newest
+		else:
+			if len(posts) == posts.maxlen:
+				size -= row_size(posts.popleft()) # the oldest post makes room
+				self.complete = False
+				position -= 1
+			posts.insert(position, post)
+			size += row_size(post)
+
+		growth = size - self.size
+		self.size = size
+		return growth
+
+# In-process store of the most viewed topics, so the first page of a hot topic needs no query
+# Every topic holds its row and its newest max_posts posts in a ring buffer. Topics are loaded the
+# first time they are read and the least recently read topics are evicted once there are more than
+# max_topics, or once the rows held take more than max_bytes.
+# load(topic id, n) returns the topic row (None for a missing topic) and its newest n + 1 posts,
+# newest first. count_post(topic row, post row) returns the topic row updated for one more post.
+# New posts are added by add_post after they commit, edits and deletes drop the topic with
+# invalidate. Posts written by other instances are only seen once an entry is reloaded, which
+# happens ttl seconds after it was loaded.
+class HotTopicStore:
+	def __init__(self, load, count_post, max_topics=256, max_posts=50, max_bytes=32*1024*1024, ttl=30):
+		self._load = load
+		self._count_post = count_post
+		self.max_topics = max_topics
+		self.max_posts = max_posts
+		self.max_bytes = max_bytes
+		self.ttl = ttl
+
+		self._topics = OrderedDict() # topic id -> _HotTopic, least recently read first
+		self._size = 0 # bytes held by every entry, estimated with row_size
+		self._loading = {} # topic id -> writes seen while it loads, None once it was invalidated
+		self._lock = threading.Lock()
+		self.stats = CacheStats()
+
+	# Function returning (topic row, newest posts first, whether those are all its posts) for a topic,
+	# loading it on a miss, or None if the topic does not exist or the store is disabled
+	def get(self, topic_id):
+		if self.max_topics <= 0:
+			return None
+
+		with self._lock:
+			entry = self._topics.get(topic_id)
+			if entry is not None and time.monotonic() - entry.loaded_at > self.ttl:
+				self._drop_locked(topic_id)
+				entry = None
+			if entry is not None:
+				self._topics.move_to_end(topic_id)
+				snapshot = (entry.topic, list(reversed(entry.posts)), entry.complete)
+
+			# a topic already being loaded by another thread is loaded again but not stored twice
+			owner = entry is None and topic_id not in self._loading
+			if owner:
+				self._loading[topic_id] = []
+
+		self.stats.record(entry is not None)
+		if entry is not None:
+			return snapshot
+
+		try:
+			topic, posts = self._load(topic_id, self.max_posts)
+		except Exception:
+			if owner:
+				with self._lock:
+					self._loading.pop(topic_id, None)
+			raise
+
+		complete = len(posts) <= self.max_posts
+		posts = posts[:self.max_posts]
+		if owner:
+			self._store(topic_id, topic, posts, complete)
+		if topic is None:
+			return None
+		return topic, posts, complete
+
+	# Function to add a post that has just committed to its topic, if the topic is held
+	def add_post(self, topic_id, post):
+		with self._lock:
+			writes = self._loading.get(topic_id)
+			if writes is not None:
+				writes.append(post)
+
+			entry = self._topics.get(topic_id)
+			if entry is not None:
+				self._size += entry.add(post, self._count_post)
+				self._evict_locked()
+
+	# Function to drop a topic, e.g. after it was edited or deleted or posts were added without their rows
+	def invalidate(self, topic_id):
+		with self._lock:
+			if topic_id in self._loading:
+				self._loading[topic_id] = None # the load in progress may have read the old rows
+			self._drop_locked(topic_id)
+		self.stats.record_invalidation()
+
+	def __len__(self):
+		return len(self._topics)
+
+	# Function returning the counters of the store for monitoring
+	def stats_dict(self):
+		stats = self.stats.as_dict()
+		with self._lock:
+			stats['topics'] = len(self._topics)
+			stats['bytes'] = self._size
+		return stats
+
+	def _store(self, topic_id, topic, posts, complete):
+		with self._lock:
+			writes = self._loading.pop(topic_id, None)
+			if writes is None or topic is None:
+				return # invalidated while loading, or nothing to hold
+
+			entry = _HotTopic(topic, posts, complete, self.max_posts)
+			# posts committed while the rows were loading, the load may or may not have seen them
+			for post in writes:
+				entry.add(post, self._count_post)
+
+			self._drop_locked(topic_id)
+			self._topics[topic_id] = entry
+			self._size += entry.size
+			self._evict_locked()
+
+	# must be called with the lock held
+	def _drop_locked(self, topic_id):
+		entry = self._topics.pop(topic_id, None)
+		if entry is not None:
+			self._size -= entry.size
+
+	# must be called with the lock held
+	def _evict_locked(self):
+		while self._topics and (len(self._topics) > self.max_topics or self._size > self.max_bytes):
+			topic_id, entry = self._topics.popitem(last=False)
+			self._size -= entry.size
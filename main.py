@@ -1,37 +1,78 @@
-from flask import Flask, render_template, request, flash, url_for, redirect
+from flask import Flask, render_template, request, flash, url_for, redirect, jsonify, abort
 from flask_cors import CORS
 from models import *
+from feed import TopicFeed
+from page_cache import PageCache
 from datetime import datetime, timedelta
+import hashlib
+import click
 
 app = Flask(__name__) # creates server object
 app.config['SECRET_KEY'] = 'UBIBPNIOEFIWEWRF'
 
+HOME_FEED_LIMIT = 25 # most topics shown on the home page
+PAGE_CACHE_SIZE = 1024 # most pages kept in the page cache
+PAGE_CACHE_TTL = 30 # seconds a cached page is served, bounds staleness of trending and of other instances' writes
+
+# reads of a client that just wrote go to the primary instead of a read replica, and skip the in-process caches
+app.before_request(begin_request)
+
+# model calls of a request share one connection, committed after the view and released at teardown
+# a view that failed (a 5xx response, including the one from the 500 handler) commits nothing,
+# its writes are rolled back when the connection is released
+@app.after_request
+def commit_database(response):
+	if response.status_code < 500:
+		commit_request()
+	return response
+
+app.teardown_request(end_request)
+
+# anonymous GET responses are served from memory until a write changes them
+# a client that wrote within PAGE_CACHE_TTL seconds gets a fresh page, a cached one may predate its write
+# when the write went through another instance, or have been rendered from a replica
+page_cache = PageCache(max_entries=PAGE_CACHE_SIZE, ttl=PAGE_CACHE_TTL, bypass=lambda: wrote_within(PAGE_CACHE_TTL) or reads_from_primary())
+
+# a new post changes its topic page, a topic change also changes the listings it appears in
+def invalidate_pages(kind, topic_id):
+	if kind == 'post':
+		page_cache.invalidate('topic:{}'.format(topic_id))
+	else:
+		page_cache.invalidate('topic:{}'.format(topic_id), 'index', 'all_topics', 'search')
+
+add_write_listener(invalidate_pages)
+
+# load the search index at startup so the first search does not have to wait for it
+# also with SEARCH_ENGINE=fulltext, the search suggestions are built from it
+topic_index.build_in_background()
+
+# remove the posts of deleted topics in the background, resuming any purge left unfinished
+topic_purger.start()
+
 # Home page route
 @app.route('/', methods=['GET','POST'])
+@page_cache.cached(lambda: ['index'])
 def index():
 
-	trending_topics = order_trending_topics() # these are the highest trending topics
-	recently_created_topics = recent_topics(5) # recently created topics
-
-	# remove topic if it is new and trending so it doesn't appear twice
-	for topic in trending_topics:
-		if topic in recently_created_topics:
-			recently_created_topics.remove(topic)
-
-	topics = trending_topics + recently_created_topics
+	# trending topics first, then recently created topics that are not already trending
+	# the sources are queried at the same time
+	feed = TopicFeed(limit=HOME_FEED_LIMIT)
+	feed.add_source('trending', order_trending_topics, priority=1)
+	feed.add_source('recent', recent_topics, 5)
+	topics = feed.build(query_executor)
 
 	# render template with topics as input
 	return render_template('index.html', topics=topics)
 
 # Route that displays the forum for a certain topic
+# posts are shown num_posts at a time, newest first, and the next page starts before the post id in before
 @app.route('/<int:topic_id>', methods=['GET','POST'])
+@page_cache.cached(lambda topic_id: ['topic:{}'.format(topic_id)])
 def topic(topic_id):
 	# get the number of posts to be loaded
-	num_posts = request.args.get('num_posts')
-	if type(num_posts) != None:
-		num_posts = int(num_posts)
-	else:
-		num_posts = 10
+	num_posts = request.args.get('num_posts', POSTS_PAGE_SIZE, type=int)
+	num_posts = min(max(num_posts, 1), MAX_POSTS_PAGE_SIZE)
+	before = request.args.get('before', type=int)
 
 	# a new post is being made
 	if request.method == 'POST': 
@@ -39,26 +80,51 @@ def topic(topic_id):
 		if not post:
 			flash('Need to enter a value for your post')
 		else:
-			add_post(post, topic_id)
-			return redirect(url_for('topic', topic_id=topic_id, num_posts=num_posts))
+			if add_post(post, topic_id):
+				return redirect(url_for('topic', topic_id=topic_id, num_posts=num_posts))
+			flash('This topic has been deleted')
+			return redirect(url_for('index'))
 
 	# retrieve the topic in question and relevant posts
+	# a deleted topic is gone, even while cached pages elsewhere still link to it
 	this_topic = get_topic(topic_id)
-	posts_in_topic = get_posts_in_topic(topic_id, num_posts) # get the amount of posts specified in address
-
-	load_more=True
-	if(len(posts_in_topic) < num_posts): # there are no more posts to be loaded
-		load_more=False
-
-	# store the datetimes from the timestamps
+	if this_topic is None:
+		abort(404)
+	posts_in_topic, next_cursor = get_posts_in_topic(topic_id, num_posts, before) # get the page of posts specified in address
+
+	dates = post_dates(posts_in_topic)
+
+	return render_template('topic.html', topic=this_topic, posts=posts_in_topic, dates=dates, num_posts=num_posts, before=before, next_cursor=next_cursor)
+
+# Returns only the next page of posts of a topic for the "Load more" link to append
+# The response is JSON with the rendered posts and the cursor for the page after it, and carries a
+# strong ETag so a client that already has this page gets a 304 instead
+@app.route('/<int:topic_id>/posts')
+@page_cache.cached(lambda topic_id: ['topic:{}'.format(topic_id)])
+def topic_posts(topic_id):
+	num_posts = request.args.get('num_posts', POSTS_PAGE_SIZE, type=int)
+	num_posts = min(max(num_posts, 1), MAX_POSTS_PAGE_SIZE)
+	before = request.args.get('before', type=int)
+
+	if get_topic(topic_id) is None:
+		abort(404)
+	posts_in_topic, next_cursor = get_posts_in_topic(topic_id, num_posts, before)
+	html = render_template('_posts.html', posts=posts_in_topic, dates=post_dates(posts_in_topic))
+
+	response = jsonify({'html': html, 'next_cursor': next_cursor})
+	response.set_etag(hashlib.sha1(response.get_data()).hexdigest())
+	response.cache_control.no_cache = True # always revalidate, the ETag makes that cheap
+	return response.make_conditional(request)
+
+# Function to convert the timestamps of posts into the datetimes displayed with them
+def post_dates(posts):
 	dates = []
-	for post in posts_in_topic:
-		this_datetime = post[2]
+	for post in posts:
+		this_datetime = post.created
 		timezone_diff = timedelta(hours=-5)
 		this_datetime = this_datetime + timezone_diff
 		dates.append(this_datetime)
-
-	return render_template('topic.html', topic=this_topic, posts=posts_in_topic, dates=dates, num_posts=num_posts,load_more=load_more)
+	return dates
 
 # Route to create a new topic
 @app.route('/newtopic', methods=['GET','POST'])
@@ -84,22 +150,29 @@ def create_topic_page():
 
 # About page
 @app.route('/about')
+@page_cache.cached(lambda: [])
 def about():
 	return render_template('about.html')
 
 # Page to edit a topic
 @app.route('/edit/<int:topic_id>', methods=['GET','POST'])
+@page_cache.cached(lambda topic_id: ['topic:{}'.format(topic_id)])
 def edit(topic_id):
 
 	# topic details edit has been submitted
 	if request.method == 'POST': 
 		topic_name = request.form['topic_name']
 		topic_description = request.form['topic_description']
-		edit_topic(topic_id, topic_name, topic_description)
-		return redirect(url_for('topic', topic_id=topic_id, num_posts=10))
+		if edit_topic(topic_id, topic_name, topic_description):
+			return redirect(url_for('topic', topic_id=topic_id, num_posts=10))
+		if get_topic(topic_id) is None: # deleted rather than the name taken
+			abort(404)
+		flash('Topic name already taken!')
 
 
 	this_topic = get_topic(topic_id)
+	if this_topic is None:
+		abort(404)
 	return render_template('edit.html',topic=this_topic)
 
 # Redirect to delete a topic of a certain id
@@ -117,34 +190,54 @@ def delete(topic_id):
 	return render_template('delete.html', topic_id=topic_id)
 
 # Page to search a topic
+# a GET with a q parameter returns topic suggestions as JSON for autocomplete
 @app.route('/search', methods=['GET','POST'])
+@page_cache.cached(lambda: ['search'])
 def search():
 	# A search is in progress
 	if request.method == 'POST': 
 		matching_topics = search_for(request.form['search_item'])
+		if not matching_topics: # no exact word matches, offer topics with similar words instead
+			matching_topics = suggest_topics(request.form['search_item'])
 		return render_template('search.html',topics=matching_topics)
 
+	query = request.args.get('q')
+	if query is not None:
+		suggestions = suggest_topics(query)
+		return jsonify([{'id': topic.id, 'name': topic.name} for topic in suggestions])
+
 	return render_template('search.html',topics=[])
 
-# Page to show all topics A-Z
+# Page to show all topics A-Z, one page at a time
+# the next page starts after the (after_name, after_id) of the last topic shown
 @app.route('/all_topics')
+@page_cache.cached(lambda: ['all_topics'])
 def all_topics():
-	topics = get_topics()
-	res = []
-	topic_num = len(topics)
-
-	# sort using insertion sort for alphabetical order
-	for i in range(topic_num):
-		first_alphabetical = 0
-		for j in range(len(topics)):
-			if topics[j][1] < topics[first_alphabetical][1]:
-				first_alphabetical = j
-
-		res.append(topics[first_alphabetical])
-		del topics[first_alphabetical]
-
-	return render_template('all_topics.html',topics=res)
-
+	page_size = request.args.get('page_size', TOPICS_PAGE_SIZE, type=int)
+	page_size = min(max(page_size, 1), MAX_TOPICS_PAGE_SIZE)
+
+	after = None
+	after_name = request.args.get('after_name')
+	after_id = request.args.get('after_id', type=int)
+	if after_name is not None and after_id is not None:
+		after = (after_name, after_id)
+
+	topics, next_cursor = get_topics_page(page_size, after)
+
+	return render_template('all_topics.html', topics=topics, page_size=page_size, next_cursor=next_cursor)
+
+# Counters for monitoring the caches and the database connection pool
+@app.route('/stats')
+def stats():
+	stats = get_stats()
+	stats['pages'] = page_cache.stats.as_dict()
+	return jsonify(stats)
+
+# Fills in the post counters of topics created before they were maintained, run once after migration 007:
+#   FLASK_APP=main.py flask backfill-topic-activity
+@app.cli.command('backfill-topic-activity')
+def backfill_topic_activity_command():
+	click.echo('updated {} topics'.format(backfill_topic_activity()))
 
 @app.errorhandler(404)
 def not_found_error(error):
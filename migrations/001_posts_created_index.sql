@@ -0,0 +1,3 @@
+-- Lets order_trending_topics read only the posts inside the trending window
+-- instead of scanning the whole posts table.
+CREATE INDEX posts_created ON posts (created);
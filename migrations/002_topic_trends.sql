@@ -0,0 +1,23 @@
+-- Running trending score per topic, maintained by add_post.
+-- score is ln(sum(e^(t/86400))) over the post times t of the topic, see
+-- _bump_trending_score in models.py. 86400 must match TRENDING_DECAY_SECONDS.
+CREATE TABLE topic_trends (
+	topic INT NOT NULL PRIMARY KEY,
+	score DOUBLE NOT NULL,
+	updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+	INDEX topic_trends_score (score)
+);
+
+-- Backfill from the existing posts. Subtracting the newest post time of each
+-- topic before exponentiating keeps EXP from overflowing.
+INSERT INTO topic_trends (topic, score, updated)
+SELECT posts.topic,
+	newest.t / 86400 + LN(SUM(EXP((UNIX_TIMESTAMP(posts.created) - newest.t) / 86400))),
+	NOW()
+FROM posts
+JOIN (SELECT topic, MAX(UNIX_TIMESTAMP(created)) AS t FROM posts GROUP BY topic) AS newest
+	ON newest.topic = posts.topic
+GROUP BY posts.topic, newest.t;
+
+-- Trending no longer reads posts by time.
+DROP INDEX posts_created ON posts;
@@ -0,0 +1,3 @@
+-- Serves the alphabetical, keyset-paginated all topics listing.
+-- InnoDB secondary indexes carry the primary key, so this orders by (name, id).
+CREATE INDEX topics_name ON topics (name);
@@ -0,0 +1,4 @@
+-- FULLTEXT index used by search_for when SEARCH_ENGINE=fulltext.
+-- Words shorter than innodb_ft_min_token_size (3 by default) and stopwords
+-- are not indexed, so they cannot produce candidates in that mode.
+ALTER TABLE topics ADD FULLTEXT INDEX topics_fulltext (name, description);
@@ -0,0 +1,4 @@
+-- Topic names are unique, create_topic relies on this index to reject duplicates.
+-- Rename or remove any existing duplicate names before running it.
+-- Replaces the plain index from 003, which served the same ordering.
+ALTER TABLE topics DROP INDEX topics_name, ADD UNIQUE INDEX topics_name (name);
@@ -0,0 +1,3 @@
+-- Serves get_posts_in_topic: the newest posts of a topic, and the page before a post id,
+-- are a range read on this index instead of sorting every post of the topic.
+CREATE INDEX posts_topic_id ON posts (topic, id);
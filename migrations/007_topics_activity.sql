@@ -0,0 +1,8 @@
+-- Per topic activity maintained by add_post in the transaction inserting the post.
+-- Existing topics start at zero; fill them in afterwards with
+--   FLASK_APP=main.py flask backfill-topic-activity
+-- which updates the topics in small batches instead of one long locking UPDATE.
+ALTER TABLE topics
+	ADD COLUMN post_count INT NOT NULL DEFAULT 0,
+	ADD COLUMN last_post_at TIMESTAMP NULL DEFAULT NULL,
+	ADD INDEX topics_last_post_at (last_post_at);
@@ -0,0 +1,11 @@
+-- delete_topic marks topics deleted and queues them here; the posts are then removed in
+-- batches by the purge worker, which records its progress on the queued row.
+-- The topic row is deleted, and its name freed for reuse, once its last post is gone.
+ALTER TABLE topics ADD COLUMN deleted_at TIMESTAMP NULL DEFAULT NULL;
+
+CREATE TABLE topic_purges (
+	topic INT NOT NULL PRIMARY KEY,
+	posts_deleted INT NOT NULL DEFAULT 0,
+	started TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+	updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,49 @@
+-- Full schema for the SQLite backend (DB_BACKEND=sqlite), equivalent to the MySQL tables with the
+-- numbered migrations applied. Run automatically when the backend is first used.
+
+CREATE TABLE IF NOT EXISTS topics (
+	id INTEGER PRIMARY KEY AUTOINCREMENT, -- AUTOINCREMENT never reuses the id of a deleted topic
+	name TEXT NOT NULL COLLATE NOCASE,
+	description TEXT NOT NULL,
+	post_count INTEGER NOT NULL DEFAULT 0,
+	last_post_at TIMESTAMP NULL DEFAULT NULL,
+	deleted_at TIMESTAMP NULL DEFAULT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS topics_name ON topics (name);
+CREATE INDEX IF NOT EXISTS topics_last_post_at ON topics (last_post_at);
+
+CREATE TABLE IF NOT EXISTS posts (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	content TEXT NOT NULL,
+	created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+	topic INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS posts_topic_id ON posts (topic, id);
+
+CREATE TABLE IF NOT EXISTS topic_trends (
+	topic INTEGER NOT NULL PRIMARY KEY,
+	score REAL NOT NULL,
+	updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS topic_trends_score ON topic_trends (score);
+
+CREATE TABLE IF NOT EXISTS topic_purges (
+	topic INTEGER NOT NULL PRIMARY KEY,
+	posts_deleted INTEGER NOT NULL DEFAULT 0,
+	started TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+	updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- FTS5 counterpart of the MySQL FULLTEXT index, used when SEARCH_ENGINE=fulltext
+CREATE VIRTUAL TABLE IF NOT EXISTS topics_fts USING fts5(name, description, content='topics', content_rowid='id');
+
+CREATE TRIGGER IF NOT EXISTS topics_fts_insert AFTER INSERT ON topics BEGIN
+	INSERT INTO topics_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+END;
+CREATE TRIGGER IF NOT EXISTS topics_fts_delete AFTER DELETE ON topics BEGIN
+	INSERT INTO topics_fts (topics_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+END;
+CREATE TRIGGER IF NOT EXISTS topics_fts_update AFTER UPDATE OF name, description ON topics BEGIN
+	INSERT INTO topics_fts (topics_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+	INSERT INTO topics_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+END;
@@ -1,8 +1,21 @@
-import sqlite3 as sql
 import os
+import atexit
+import time
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
 from os import path
-import pymysql
-from datetime import datetime, timedelta
+from flask import g, has_request_context, session
+from pool import ConnectionPool
+from replicas import ReplicaSet
+from storage import MySQLBackend, SQLiteBackend
+from search_index import SearchIndex, rank_topics
+from trigram_index import TrigramIndex
+from cache import LRUCache, ExternalCache, FakeCacheClient, read_through
+from write_behind import WriteBehindQueue
+from unit_of_work import UnitOfWork
+from purge import TopicPurger
+from hot_topics import HotTopicStore
+from records import Topic, read_topics, read_topic, read_posts, read_post
 
 ROOT = path.dirname(path.relpath(__file__)) # gets the location on computer of this directory
 
@@ -11,36 +24,324 @@ db_password = 'window'
 db_name = 'master'
 db_connection_name = 'maxs-message-board:us-east1:messageboard-data'
 
-# Establishes connection with Google Cloud SQL database
-def get_connection():
+TRENDING_TOPIC_COUNT = 20 # number of topics shown as trending on the home page
+TRENDING_DECAY_SECONDS = 24*60*60 # a post's contribution to trending shrinks by a factor of e every day
+POSTS_PAGE_SIZE = 10 # posts shown per page of a topic
+MAX_POSTS_PAGE_SIZE = 100
+POST_WRITE_BEHIND = os.environ.get('POST_WRITE_BEHIND') == '1' # queue posts and insert them in batches
+POST_BATCH_SIZE = int(os.environ.get('POST_BATCH_SIZE', 100)) # most posts in one multi-row INSERT
+POST_BATCH_DELAY = float(os.environ.get('POST_BATCH_DELAY', 0.05)) # seconds a queued post may wait for its batch to fill
+POST_QUEUE_SIZE = int(os.environ.get('POST_QUEUE_SIZE', 10000)) # posts are written synchronously while the queue is full
+PURGE_BATCH_SIZE = 1000 # posts of a deleted topic removed per transaction
+PURGE_PAUSE = 0.1 # seconds between purge batches, leaves room for other writers
+PURGE_POLL_INTERVAL = 60 # seconds between checks for purges left unfinished, e.g. by a crashed instance
+SEARCH_RESULT_LIMIT = 50 # most topics returned for one search
+TOPICS_PAGE_SIZE = 50 # topics per page of the all topics listing
+MAX_TOPICS_PAGE_SIZE = 500
+SEARCH_ENGINE = os.environ.get('SEARCH_ENGINE', 'index') # 'index' or 'fulltext', see search_for
+FULLTEXT_CANDIDATE_LIMIT = 500 # most rows the FULLTEXT search hands to the similarity ranking
+SEARCH_INDEX_MAX_AGE = float(os.environ.get('SEARCH_INDEX_MAX_AGE', 300)) # seconds before the search index is reloaded from the database
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory') # 'memory' or 'fake_external', see _make_read_cache
+CACHE_TTL = float(os.environ.get('CACHE_TTL', 60)) # seconds a cached read may be served, bounds staleness across instances
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 4096))
+RECENT_TOPICS_CACHED = 20 # recent_topics caches this many topics and serves smaller counts from them
+HOT_TOPICS = int(os.environ.get('HOT_TOPICS', 256)) # topics whose newest posts are held in memory, 0 turns the hot topic store off
+HOT_TOPIC_POSTS = int(os.environ.get('HOT_TOPIC_POSTS', 50)) # posts held per hot topic, a first page of up to this many is served from memory
+HOT_TOPICS_MAX_BYTES = int(os.environ.get('HOT_TOPICS_MAX_BYTES', 32*1024*1024)) # estimated memory the hot topic store may use
+HOT_TOPIC_TTL = float(os.environ.get('HOT_TOPIC_TTL', 30)) # seconds before a hot topic is reloaded, bounds how long other instances' posts go unseen
+SUGGESTION_LIMIT = 10 # most topics suggested while typing a search
+SUGGESTION_BUDGET = 0.05 # seconds a suggestion lookup may spend matching misspelled words
+SUGGESTION_REBUILD_INTERVAL = float(os.environ.get('SUGGESTION_REBUILD_INTERVAL', 60)) # least seconds between rebuilds of the suggestion index, new topics are suggested after up to this long
+TOPIC_STREAM_BATCH_SIZE = 1000 # rows get_topics fetches from the database at a time
+DB_BACKEND = os.environ.get('DB_BACKEND', 'mysql') # 'mysql' or 'sqlite', see _make_backend
+SQLITE_PATH = os.environ.get('SQLITE_PATH', path.join(ROOT, 'message_board.db'))
+DB_REPLICAS = [replica for replica in os.environ.get('DB_REPLICAS', '').split(',') if replica] # read replicas, see _make_backend
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 5)) # seconds a replica may be behind and still serve reads
+REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get('REPLICA_LAG_CHECK_INTERVAL', 5)) # seconds between lag measurements of a replica
+REPLICA_CHECKOUT_TIMEOUT = 1 # seconds a read waits for a busy replica before trying the next one or the primary
+# seconds the reads of a client that wrote go to the primary. A replica's lag can grow for up to
+# REPLICA_LAG_CHECK_INTERVAL seconds before it is noticed, so this covers the worst lag a replica serving reads can have
+READ_YOUR_WRITES_WINDOW = float(os.environ.get('READ_YOUR_WRITES_WINDOW', REPLICA_MAX_LAG + REPLICA_LAG_CHECK_INTERVAL))
+
+# Creates the storage backend the data layer runs on
+#   'mysql'  - the Google Cloud SQL database (default)
+#   'sqlite' - the database file at SQLITE_PATH, created with migrations/sqlite_schema.sql if it is new
+# replica is an entry of DB_REPLICAS, or None for the primary:
+#   'mysql'  - the Cloud SQL connection name of a read replica on app engine, its proxy's host[:port] locally
+#   'sqlite' - the path of a second database file standing in for a replica
+def _make_backend(replica=None):
+	if DB_BACKEND == 'sqlite':
+		return SQLiteBackend(replica or SQLITE_PATH, schema=path.join(ROOT, 'migrations', 'sqlite_schema.sql'))
+
 	# when deployed to app engine the 'GAE_ENV' variable will be set to 'standard'
 	if os.environ.get('GAE_ENV') == 'standard':
 		# use the local socket interface for accessing Cloud SQL
-		unix_socket = '/cloudsql/{}'.format(db_connection_name)
-		conn = pymysql.connect(user=db_user, password=db_password, unix_socket=unix_socket, db=db_name)
-	else:
-		# if running locally use the TCP connections instead
-		# set up Cloud SQL proxy (cloud.google.com/sql/docs/mysql/sql-proxy)
-		host = '127.0.0.1'
-		conn = pymysql.connect(user=db_user, password=db_password, host=host, db=db_name)
-
+		unix_socket = '/cloudsql/{}'.format(replica or db_connection_name)
+		return MySQLBackend(user=db_user, password=db_password, unix_socket=unix_socket, db=db_name)
+
+	# if running locally use the TCP connections instead
+	# set up Cloud SQL proxy (cloud.google.com/sql/docs/mysql/sql-proxy)
+	host, _, port = (replica or '127.0.0.1').partition(':')
+	return MySQLBackend(user=db_user, password=db_password, host=host, port=int(port or 3306), db=db_name)
+
+# Creates a connection pool configured by the DB_POOL_* variables
+def _make_pool(backend, checkout_timeout=None):
+	if checkout_timeout is None:
+		checkout_timeout = float(os.environ.get('DB_POOL_CHECKOUT_TIMEOUT', 10))
+	return ConnectionPool(
+		backend.connect,
+		min_size=int(os.environ.get('DB_POOL_MIN_SIZE', 1)),
+		max_size=int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+		idle_timeout=float(os.environ.get('DB_POOL_IDLE_TIMEOUT', 300)),
+		checkout_timeout=checkout_timeout,
+		ping_interval=float(os.environ.get('DB_POOL_PING_INTERVAL', 30)),
+	)
+
+backend = _make_backend()
+
+# connections are reused across requests instead of paying a connect/auth handshake per query
+connection_pool = _make_pool(backend)
+
+# read replicas with a pool each, None without DB_REPLICAS, see get_read_connection
+replica_set = None
+if DB_REPLICAS:
+	replica_set = ReplicaSet(
+		[_make_pool(_make_backend(replica), checkout_timeout=REPLICA_CHECKOUT_TIMEOUT) for replica in DB_REPLICAS],
+		backend.replication_lag,
+		max_lag=REPLICA_MAX_LAG,
+		check_interval=REPLICA_LAG_CHECK_INTERVAL,
+	)
+
+# Creates the cache for topic reads
+#   'memory'        - an LRU cache inside this instance
+#   'fake_external' - the external store interface backed by a local fake, for trying out a shared store
+# a real shared store (e.g. a memcached client) can be plugged in with use_read_cache(ExternalCache(client))
+def _make_read_cache():
+	if CACHE_BACKEND == 'fake_external':
+		return ExternalCache(FakeCacheClient(), ttl=CACHE_TTL)
+	return LRUCache(max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+
+read_cache = _make_read_cache()
+
+# Function to replace the cache used for topic reads
+def use_read_cache(cache):
+	global read_cache
+	read_cache = cache
+
+# Thread pool running model calls on behalf of a request
+# A call runs without the context of the request that submitted it, so it never touches the request's
+# unit of work and its connection, which must not be used by two threads at once, and checks out a
+# connection of its own. Only where the request's reads go and when its client last wrote are carried over.
+class _QueryExecutor(ThreadPoolExecutor):
+	def submit(self, fn, /, *args, **kwargs):
+		return super().submit(_run_with_read_state, reads_from_primary(), _last_write(), fn, *args, **kwargs)
+
+def _run_with_read_state(primary_reads, wrote_at, fn, *args, **kwargs):
+	primary_token = _primary_reads.set(primary_reads)
+	wrote_token = _wrote_at.set(wrote_at)
+	try:
+		return fn(*args, **kwargs)
+	finally:
+		_wrote_at.reset(wrote_token)
+		_primary_reads.reset(primary_token)
+
+# threads for running independent model calls concurrently, see query_batch.py and models_async.py
+# one per pooled connection, more threads would only wait for a connection
+query_executor = _QueryExecutor(max_workers=connection_pool.max_size, thread_name_prefix='models')
+
+# Function returning the cache and connection pool counters for monitoring
+def get_stats():
+	stats = {'cache': read_cache.stats.as_dict(), 'pool': connection_pool.stats()}
+	stats['hot_topics'] = hot_topics.stats_dict()
+	if replica_set is not None:
+		stats['replicas'] = replica_set.stats()
+	return stats
+
+# Checks out a connection with Google Cloud SQL database from the pool
+# calling close() on it returns it to the pool
+# Inside a request every call shares one connection and its writes commit together when the request
+# ends, see commit_request and end_request. Other threads (background work, concurrent queries of
+# a QueryBatch) have no request and get a connection of their own.
+def get_connection():
+	unit_of_work = _request_unit_of_work()
+	if unit_of_work is not None:
+		return unit_of_work.connection()
+	return connection_pool.connect()
+
+# Checks out a connection for a query that only reads
+# Reads go to a read replica when DB_REPLICAS are configured and one of them is caught up, and to the
+# primary otherwise. They go to the primary as well while the current client must see its own writes,
+# see begin_request. Call close() on the connection when done, like for get_connection.
+def get_read_connection():
+	if replica_set is None or reads_from_primary():
+		return get_connection()
+
+	conn = replica_set.connect()
+	if conn is None: # every replica is too far behind or unreachable
+		return get_connection()
 	return conn
 
+# set for the requests whose reads must go to the primary, see begin_request
+# a context variable rather than g, query_executor hands its value to the calls it runs for the request
+_primary_reads = ContextVar('primary_reads', default=False)
+
+# time the client of the current request last wrote, 0 if it has not, see begin_request
+_wrote_at = ContextVar('wrote_at', default=0)
+
+# Function returning True if reads must go to the primary right now
+# that is for a client that wrote recently, and for the rest of a request once it has written
+def reads_from_primary():
+	if _primary_reads.get():
+		return True
+	unit_of_work = g.get('unit_of_work') if has_request_context() else None
+	return unit_of_work is not None and unit_of_work.has_writes
+
+# Function wrapping fn so that its reads go to the primary
+# used for whatever fills a cache or index that writes update after they commit, a load from a
+# replica that is behind could put back what a write just replaced
+def _on_primary(fn):
+	def run(*args, **kwargs):
+		token = _primary_reads.set(True)
+		try:
+			return fn(*args, **kwargs)
+		finally:
+			_primary_reads.reset(token)
+	return run
+
+# Function returning True if the current client wrote within the last seconds, or the current request has written
+# in-process copies (the page cache, hot_topics) that another instance's write has not reached are
+# bypassed for such a client, e.g. the page it is redirected to after a POST shows its new post
+def wrote_within(seconds):
+	return time.time() - _last_write() < seconds
+
+def _last_write():
+	unit_of_work = g.get('unit_of_work') if has_request_context() else None
+	if unit_of_work is not None and unit_of_work.has_writes:
+		return time.time()
+	return _wrote_at.get()
+
+# Function to decide where the reads of the current request go, registered with app.before_request
+# A client that wrote within the last READ_YOUR_WRITES_WINDOW seconds reads from the primary, e.g.
+# the page it is redirected to after a POST shows its new post however far behind the replicas are
+def begin_request():
+	wrote_at = session.get('wrote_at', 0)
+	_wrote_at.set(wrote_at)
+	_primary_reads.set(time.time() - wrote_at < READ_YOUR_WRITES_WINDOW)
+
+# Function to remember in the session that the current client has just written, see begin_request
+# kept in the session cookie, so it holds whichever instance serves the client's next request
+def _record_write():
+	if has_request_context():
+		session['wrote_at'] = time.time()
+
+# only a request has a unit of work, committed by commit_request when it ends
+# writes made anywhere else (the shell, CLI commands, scripts under app.app_context()) commit straight away
+def _request_unit_of_work():
+	if not has_request_context():
+		return None
+	if 'unit_of_work' not in g:
+		g.unit_of_work = UnitOfWork(connection_pool.connect)
+	return g.unit_of_work
+
+# Function to commit the writes made during the current request
+# registered with app.after_request, so a failed commit still turns into an error response
+def commit_request():
+	unit_of_work = g.get('unit_of_work') if has_request_context() else None
+	if unit_of_work is not None:
+		if unit_of_work.has_writes:
+			_record_write()
+		unit_of_work.commit()
+
+# Function to return the connection of the current request to the pool
+# registered with app.teardown_request, anything not committed by then is rolled back
+def end_request(exc=None):
+	unit_of_work = g.pop('unit_of_work', None) if has_request_context() else None
+	if unit_of_work is not None:
+		unit_of_work.close()
+
+# Function to run fn once the current writes are committed
+# caches and in-process indexes are only updated after the data they mirror is visible to others
+def _after_commit(fn):
+	unit_of_work = g.get('unit_of_work') if has_request_context() else None
+	if unit_of_work is not None and unit_of_work.has_writes:
+		unit_of_work.after_commit(fn)
+	else:
+		fn()
+
 # Function to fetch all of the topics in the database
-# Returns a python list of lists, where each sublist has the attriubtes of one topic
-def get_topics():
-	conn = get_connection()
+# Returns an iterator of Topic records (see records.py) that reads them from a server-side cursor
+# batch_size rows at a time, so the whole table is never held in memory by the query. The iterator
+# has a connection of its own until it is exhausted, and does not see writes of the current request
+# that are not committed yet.
+def get_topics(batch_size=TOPIC_STREAM_BATCH_SIZE):
+	# the connection is picked and the query sent right away, not when iteration starts, so the
+	# iterator reads from wherever the reads of the caller go
+	conn = _stream_connection()
+	try:
+		cur = backend.streaming_cursor(conn)
+		cur.execute('SELECT * FROM topics WHERE deleted_at IS NULL')
+	except Exception:
+		conn.close()
+		raise
+
+	return _stream_records(conn, cur, Topic, batch_size)
+
+# Checks out a connection of its own for a streaming read, never the connection shared by the request,
+# which would be unusable for any other query until the stream is read to the end
+def _stream_connection():
+	if replica_set is not None and not reads_from_primary():
+		conn = replica_set.connect()
+		if conn is not None:
+			return conn
+	return connection_pool.connect()
+
+# Generator turning the rows of cur into records, batch_size rows at a time
+# gives the connection back once the rows run out or the generator is closed
+def _stream_records(conn, cur, record, batch_size):
+	try:
+		while True:
+			rows = cur.fetchmany(batch_size)
+			if not rows:
+				break
+			for row in rows:
+				yield record(*row)
+	finally:
+		cur.close() # reads and drops any rows left, so the connection can be reused
+		conn.close()
+
+# inverted index over topic names used by search_for
+# kept up to date by create_topic, edit_topic and delete_topic, and reloaded periodically
+# to pick up changes made by other instances
+topic_index = SearchIndex(_on_primary(get_topics), max_age=SEARCH_INDEX_MAX_AGE)
+
+# trigram index over the words of topic names for prefix and typo tolerant suggestions
+# derived from topic_index, so it follows the same updates, at most once every SUGGESTION_REBUILD_INTERVAL seconds
+topic_suggestions = TrigramIndex(topic_index, budget=SUGGESTION_BUDGET, rebuild_interval=SUGGESTION_REBUILD_INTERVAL)
+
+# Function to fetch one page of topics in alphabetical order
+# after is the (name, id) of the last topic on the previous page, or None for the first page
+# Returns the topics on the page and the cursor for the next page (None if this is the last page)
+def get_topics_page(page_size, after=None):
+	conn = get_read_connection()
 	cur = conn.cursor()
-	cur.execute('SELECT * FROM topics')
-	topics = cur.fetchall()
+
+	# fetch one extra row to find out whether there is another page
+	if after is None:
+		cur.execute('SELECT * FROM topics WHERE deleted_at IS NULL ORDER BY name, id LIMIT %s', (page_size + 1,))
+	else:
+		after_name, after_id = after
+		cur.execute(
+			'SELECT * FROM topics WHERE (name > %s OR (name = %s AND id > %s)) AND deleted_at IS NULL ORDER BY name, id LIMIT %s',
+			(after_name, after_name, after_id, page_size + 1))
+	topics = read_topics(cur)
 	conn.close()
 
-	# convert tuple of tuples to list of tuples
-	res = []
-	for topic in topics:
-		res.append(topic)
+	next_cursor = None
+	if len(topics) > page_size:
+		del topics[page_size:]
+		next_cursor = (topics[-1].name, topics[-1].id)
 
-	return res
+	return topics, next_cursor
 
 # Function to create a new topic and insert into the database
 # Input is the topic name and description
@@ -48,186 +349,448 @@ def create_topic(name, description):
 	conn = get_connection()
 	cur = conn.cursor()
 
-	topics = get_topics()
-
-	# check if this topic already exists
-	for topic in topics:
-		if topic[1] == name:
+	# insert topic, the unique index on topics.name rejects a name that already exists
+	try:
+		cur.execute('INSERT into topics (name, description) values(%s,%s)', (name,description))
+	except backend.IntegrityError as e:
+		conn.close()
+		if backend.is_duplicate(e):
 			return False
+		raise
 
-	# insert topic, commit, and close connection
-	cur.execute('INSERT into topics (name, description) values(%s,%s)', (name,description))
+	cur.execute('SELECT * FROM topics WHERE id=%s', (cur.lastrowid,))
+	topic = read_topic(cur)
 	conn.commit()
 	conn.close()
+
+	_after_commit(lambda: _topic_changed(topic.id, topic))
 	return True
 
-# Function to fetch all the posts within a topic
-def get_posts_in_topic(topic_id, num_posts):
-	conn = get_connection()
+# Function to fetch a page of the posts within a topic, newest first
+# before_id is the id of the last post on the previous page, or None for the newest posts
+# Returns the posts and the cursor for the next page (None if there are no older posts)
+def get_posts_in_topic(topic_id, num_posts, before_id=None):
+	# the first page of a topic held by hot_topics needs no query
+	if before_id is None and num_posts <= HOT_TOPIC_POSTS and _hot_topics_usable():
+		hot = hot_topics.get(topic_id)
+		if hot is not None:
+			topic, posts, complete = hot
+			next_cursor = None
+			if len(posts) > num_posts or (len(posts) == num_posts and not complete):
+				next_cursor = posts[num_posts - 1].id
+			return posts[:num_posts], next_cursor
+
+	conn = get_read_connection()
 	cur = conn.cursor()
-	cur.execute('SELECT * FROM posts WHERE topic=%s ORDER BY id DESC LIMIT %s', (topic_id,num_posts))
-	posts_in_topic = cur.fetchall()
+
+	# fetch one extra row to find out whether there are older posts
+	# the posts of a deleted topic stay until the purge removes them, they are not shown
+	if before_id is None:
+		cur.execute(
+			'SELECT posts.* FROM posts JOIN topics ON topics.id = posts.topic '
+			'WHERE posts.topic=%s AND topics.deleted_at IS NULL ORDER BY posts.id DESC LIMIT %s',
+			(topic_id,num_posts + 1))
+	else:
+		cur.execute(
+			'SELECT posts.* FROM posts JOIN topics ON topics.id = posts.topic '
+			'WHERE posts.topic=%s AND posts.id<%s AND topics.deleted_at IS NULL ORDER BY posts.id DESC LIMIT %s',
+			(topic_id,before_id,num_posts + 1))
+	posts_in_topic = read_posts(cur)
 	conn.close()
 
-	return posts_in_topic
+	next_cursor = None
+	if len(posts_in_topic) > num_posts:
+		del posts_in_topic[num_posts:]
+		next_cursor = posts_in_topic[-1].id
+
+	return posts_in_topic, next_cursor
 
 # Function to add post to a topic given a string for the post itself and a topic id
+# With POST_WRITE_BEHIND the post is queued and written with others shortly after, see write_behind.py
+# Returns False if the topic does not exist or has been deleted (a queued post to such a topic is
+# dropped when its batch is written)
 def add_post(post,topic_id):
+	if POST_WRITE_BEHIND and post_queue.submit((post, topic_id)):
+		_record_write()
+		return True
+
 	conn = get_connection()
 	cur = conn.cursor()
 
+	# counted first: it locks the topic row, so the topic cannot be deleted before this commits
+	if not _count_posts(cur, topic_id):
+		conn.close()
+		return False
+
 	cur.execute('INSERT into posts (content, topic) values(%s,%s)', (post,topic_id))
+	post_id = cur.lastrowid
+	_bump_trending_score(cur, topic_id)
+
+	# read back with its created time, for hot_topics
+	cur.execute('SELECT * FROM posts WHERE id=%s', (post_id,))
+	new_post = read_post(cur)
 
 	conn.commit()
 	conn.close()
 
-# Function to return a single topic
-def get_topic(topic_id):
+	_after_commit(lambda: _posts_added(topic_id, new_post))
+	return True
+
+# Function to insert a batch of queued (post, topic id) pairs in one transaction
+# posts to topics that have been deleted in the meantime are dropped
+def _add_posts(posts):
 	conn = get_connection()
 	cur = conn.cursor()
-	cur.execute('SELECT * FROM topics WHERE id=%s',(topic_id,))
-	topic = cur.fetchone()
-	conn.close()
 
-	return topic
+	post_counts = {} # topic id -> number of posts in this batch
+	for post, topic_id in posts:
+		post_counts[topic_id] = post_counts.get(topic_id, 0) + 1
+	for topic_id, count in list(post_counts.items()):
+		if _count_posts(cur, topic_id, count):
+			_bump_trending_score(cur, topic_id, count)
+		else:
+			del post_counts[topic_id]
 
-# Function to edit a topic
-def edit_topic(topic_id, name, description):
-	conn = get_connection()
-	cur = conn.cursor()
-	cur.execute('UPDATE topics SET name=%s, description=%s WHERE id=%s',(name,description,topic_id))
+	# pymysql turns this into a single multi-row INSERT, sqlite reuses one compiled statement for every row
+	posts = [(post, topic_id) for post, topic_id in posts if topic_id in post_counts]
+	if posts:
+		cur.executemany('INSERT into posts (content, topic) values(%s,%s)', posts)
 
 	conn.commit()
 	conn.close()
 
-# Function to delete a topic
-def delete_topic(topic_id):
-	conn = get_connection()
-	cur = conn.cursor()
+	for topic_id in post_counts:
+		_posts_added(topic_id)
+
+# Function to keep the post_count and last_post_at columns of a topic in step with new posts
+# runs in the transaction inserting the posts
+# Returns False if the topic does not exist or has been deleted, the posts must not be written then
+def _count_posts(cur, topic_id, count=1):
+	cur.execute('UPDATE topics SET post_count = post_count + %s, last_post_at = NOW() WHERE id=%s AND deleted_at IS NULL', (count, topic_id))
+	return cur.rowcount > 0
+
+# Function to update caches after posts were added to a topic
+# post is the row of the new post, or None for a batch of posts that were not read back
+def _posts_added(topic_id, post=None):
+	read_cache.delete('topic:{}'.format(topic_id)) # the cached row has the old post count
+	if post is None:
+		hot_topics.invalidate(topic_id)
+	else:
+		hot_topics.add_post(topic_id, post)
+	_notify_write('post', topic_id)
 
-	# must delete all posts associated with this topic as well as the topics
-	cur.execute('DELETE FROM posts WHERE topic=%s', (topic_id,))
-	cur.execute('DELETE FROM topics WHERE id=%s', (topic_id,))
+# Function to fill in post_count and last_post_at for topics that existed before the columns did
+# works through the topics in id order, batch_size topics per transaction, so it can be stopped and rerun
+def backfill_topic_activity(batch_size=500):
+	conn = connection_pool.connect() # its own connection and transactions, even inside a request
+	cur = conn.cursor()
+	last_id = 0
+	updated = 0
 
-	
+	while True:
+		cur.execute('SELECT MAX(id) FROM (SELECT id FROM topics WHERE id > %s ORDER BY id LIMIT %s) AS batch', (last_id, batch_size))
+		batch_end = cur.fetchone()[0]
+		if batch_end is None:
+			break
 
-	conn.commit()
-	conn.close()
+		# correlated subqueries rather than an UPDATE ... JOIN so the statement runs on every backend,
+		# each is a range read of the posts (topic, id) index
+		cur.execute(
+			'UPDATE topics SET'
+			' post_count = (SELECT COUNT(*) FROM posts WHERE posts.topic = topics.id),'
+			' last_post_at = (SELECT MAX(created) FROM posts WHERE posts.topic = topics.id) '
+			'WHERE topics.id > %s AND topics.id <= %s',
+			(last_id, batch_end))
+		conn.commit()
 
-# Function to search for a topic
-def search_for(search_item):
+		updated += cur.rowcount
+		last_id = batch_end
 
-	# get the topics from the database
-	conn = get_connection()
-	cur = conn.cursor()
-	cur.execute('SELECT * FROM topics')
-	topics = cur.fetchall()
 	conn.close()
+	return updated
+
+# posts waiting to be written when POST_WRITE_BEHIND is on
+post_queue = WriteBehindQueue(
+	_add_posts,
+	lambda item: _add_posts([item]),
+	max_batch=POST_BATCH_SIZE,
+	max_delay=POST_BATCH_DELAY,
+	max_queue=POST_QUEUE_SIZE,
+)
+atexit.register(post_queue.flush)
 
-	split_search_item = search_item.lower().split() # split the search term
+# Function to return a single topic
+# only the topic row, through read_cache; its posts are served from hot_topics by get_posts_in_topic
+def get_topic(topic_id):
+	return read_through(read_cache, 'topic:{}'.format(topic_id), _on_primary(lambda: _load_topic(topic_id)))
 
-	results = [] # list to hold matching topics to the search term
-	matching_topics_similarity = [0]*len(topics) # list to keep track of how similar each match is to the search term
+# Function returning True if the current reads may be answered from hot_topics
+# not for a client that wrote through another instance within HOT_TOPIC_TTL seconds, this instance's
+# copy of the topic may not have its write yet
+def _hot_topics_usable():
+	return not reads_from_primary() and not wrote_within(HOT_TOPIC_TTL)
 
-	for i in range(len(topics)):
-		topic_split = topics[i][1].lower().split() # lowercase and split the topic name
-		
-		for j in range(len(topic_split)): # iterate through through the topic keys
-			for k in range(len(split_search_item)): # iterate through the search keys
-				if topic_split[j] == split_search_item[k]:
-					matching_topics_similarity[i] += (10-k)*(10-j) # add value to similarities if it has a matching word
+# Function to read a topic row and its newest num_posts + 1 posts for hot_topics
+def _load_hot_topic(topic_id, num_posts):
+	conn = get_read_connection()
+	cur = conn.cursor()
+	cur.execute('SELECT * FROM topics WHERE id=%s AND deleted_at IS NULL', (topic_id,))
+	topic = read_topic(cur)
+	posts = []
+	if topic is not None:
+		cur.execute('SELECT * FROM posts WHERE topic=%s ORDER BY id DESC LIMIT %s', (topic_id, num_posts + 1))
+		posts = read_posts(cur)
+	conn.close()
 
-	while(len(matching_topics_similarity) > 0):
-		highest_index = 0
+	return topic, posts
+
+# Function returning a topic row updated for one more post, like _count_posts does in the database
+# a new record, the old one may still be in use by a reader
+def _count_post(topic, post):
+	last_post_at = post.created if topic.last_post_at is None else max(topic.last_post_at, post.created)
+	return Topic(topic.id, topic.name, topic.description, topic.post_count + 1, last_post_at, topic.deleted_at)
+
+# topic rows and newest posts of the most read topics, so their first page is served from memory
+# loaded from the primary like the other caches that writes update
+hot_topics = HotTopicStore(
+	_on_primary(_load_hot_topic),
+	_count_post,
+	max_topics=HOT_TOPICS,
+	max_posts=HOT_TOPIC_POSTS,
+	max_bytes=HOT_TOPICS_MAX_BYTES,
+	ttl=HOT_TOPIC_TTL,
+)
+
+def _load_topic(topic_id):
+	conn = get_read_connection()
+	cur = conn.cursor()
+	cur.execute('SELECT * FROM topics WHERE id=%s AND deleted_at IS NULL',(topic_id,))
+	topic = read_topic(cur)
+	conn.close()
 
-		for i in range(len(matching_topics_similarity)):
-			# first find the highest index of similarity
-			if matching_topics_similarity[i] > matching_topics_similarity[highest_index]:
-				highest_index = i
+	return topic
 
-		if matching_topics_similarity[highest_index] == 0: # break if highest match is 0
-			break
+# Function to edit a topic
+# Returns False if another topic already has the new name, or the topic does not exist or has been deleted
+def edit_topic(topic_id, name, description):
+	conn = get_connection()
+	cur = conn.cursor()
 
-		# add the highest matching topic to the results and delete from similarities list
-		results.append(topics[highest_index])
-		del matching_topics_similarity[highest_index]
+	try:
+		cur.execute('UPDATE topics SET name=%s, description=%s WHERE id=%s AND deleted_at IS NULL',(name,description,topic_id))
+	except backend.IntegrityError as e:
+		conn.close()
+		if backend.is_duplicate(e):
+			return False
+		raise
 
-	return results
+	cur.execute('SELECT * FROM topics WHERE id=%s AND deleted_at IS NULL', (topic_id,))
+	topic = read_topic(cur)
+	if topic is None:
+		conn.close()
+		# deleted, possibly through another instance, so drop what this one still holds of it
+		_after_commit(lambda: _topic_changed(topic_id, None))
+		return False
 
+	conn.commit()
+	conn.close()
 
-# Function to order topics based on how recently there have been discussions in them
-def order_trending_topics():
+	_after_commit(lambda: _topic_changed(topic_id, topic))
+	return True
 
-	# get all posts from the database
+# Function to delete a topic
+# The topic is marked deleted right away and disappears from every page. Its posts are removed
+# afterwards in small batches by topic_purger, so a large topic does not hold locks on posts for
+# long, and the topic row itself goes once its last post is gone.
+def delete_topic(topic_id):
 	conn = get_connection()
 	cur = conn.cursor()
-	cur.execute('SELECT * FROM posts')
-	posts = cur.fetchall()
 
-	# find maximum index of a topic
-	cur.execute('SELECT MAX(id) FROM topics')
-	max_index = cur.fetchone()[0]
+	cur.execute('UPDATE topics SET deleted_at = NOW() WHERE id=%s AND deleted_at IS NULL', (topic_id,))
+	if cur.rowcount:
+		# the purge queue doubles as the record of progress, so a purge cut short resumes where it stopped
+		cur.execute('INSERT INTO topic_purges (topic, started, updated) VALUES (%s, NOW(), NOW())', (topic_id,))
+		cur.execute('DELETE FROM topic_trends WHERE topic=%s', (topic_id,))
 
-	if not max_index:
-		return []
+	conn.commit()
+	conn.close()
 
-	# every index of this array will correlate to how much the topic of that id is trending
-	# the higher the value the more it is trending
-	topic_trends = [0]*(max_index + 1)
+	_after_commit(lambda: _topic_changed(topic_id, None))
+	_after_commit(topic_purger.wake)
 
-	date_format = '%Y-%m-%s %H:%M:%S' # format of a sql timestamp, used to convert timestamp to python datetime
+# Function returning the ids of deleted topics whose posts are still being removed
+def _pending_purges():
+	conn = connection_pool.connect()
+	cur = conn.cursor()
+	cur.execute('SELECT topic FROM topic_purges ORDER BY topic')
+	topic_ids = [row[0] for row in cur.fetchall()]
+	conn.close()
+
+	return topic_ids
+
+# Function to delete the next batch of posts of a deleted topic
+# Returns the number of posts deleted, 0 once there are none left
+def _purge_posts(topic_id):
+	conn = connection_pool.connect()
+	cur = conn.cursor()
+	if backend.dialect == 'sqlite':
+		# sqlite is usually built without DELETE ... LIMIT
+		cur.execute('DELETE FROM posts WHERE id IN (SELECT id FROM posts WHERE topic=%s ORDER BY id LIMIT %s)', (topic_id, PURGE_BATCH_SIZE))
+	else:
+		cur.execute('DELETE FROM posts WHERE topic=%s ORDER BY id LIMIT %s', (topic_id, PURGE_BATCH_SIZE))
+	deleted = cur.rowcount
+	cur.execute('UPDATE topic_purges SET posts_deleted = posts_deleted + %s, updated = NOW() WHERE topic=%s', (deleted, topic_id))
+	conn.commit()
+	conn.close()
 
-	for post in posts:
+	return deleted
 
-		post_datetime = post[2]
-		
-		timezone_diff = timedelta(hours=+5)
-		current_datetime = datetime.now() + timezone_diff
-		time_diff = current_datetime - post_datetime
+# Function to remove a deleted topic once all its posts are gone
+def _finish_purge(topic_id):
+	conn = connection_pool.connect()
+	cur = conn.cursor()
+	cur.execute('DELETE FROM topics WHERE id=%s AND deleted_at IS NOT NULL', (topic_id,))
+	cur.execute('DELETE FROM topic_trends WHERE topic=%s', (topic_id,))
+	cur.execute('DELETE FROM topic_purges WHERE topic=%s', (topic_id,))
+	conn.commit()
+	conn.close()
 
-		# don't consider this post if it was over a week ago
-		if time_diff.days > 7:
-			topic_trends[post[3]] += 0.01 # even if the time difference is great, add something so this topic is considered
-			continue
+# Function returning the progress of the topic deletions still running
+# a list of (topic id, posts deleted so far, time deletion started, time of the last batch)
+def purge_progress():
+	conn = get_connection()
+	cur = conn.cursor()
+	cur.execute('SELECT topic, posts_deleted, started, updated FROM topic_purges ORDER BY topic')
+	progress = list(cur.fetchall())
+	conn.close()
 
-		time_diff_seconds = time_diff.days*24*60*60 + time_diff.seconds
-		
+	return progress
 
-		topic_trends[post[3]] += (24*60*60-time_diff_seconds)/1000
+# background worker removing the posts of deleted topics, started by main
+topic_purger = TopicPurger(_pending_purges, _purge_posts, _finish_purge, pause=PURGE_PAUSE, poll_interval=PURGE_POLL_INTERVAL)
 
-	# for 20 iterations add the topic with the highest trend to the result
-	highest_trend = 0
-	res = []
-	for i in range(20):
-		for j in range(1,max_index+1):
-			if topic_trends[j] > topic_trends[highest_trend]:
-				highest_trend = j
+# Function to search for a topic
+# SEARCH_ENGINE picks how candidate topics are found:
+#   'index'    - the in-process inverted index over topic names (default)
+#   'fulltext' - a MATCH ... AGAINST query on the FULLTEXT index of topics (the topics_fts FTS5
+#                table on sqlite), with the positional similarity applied to the returned candidates only
+def search_for(search_item, limit=SEARCH_RESULT_LIMIT):
+	if SEARCH_ENGINE == 'fulltext':
+		return _fulltext_search(search_item, limit)
+	return topic_index.search(search_item, limit)
+
+# Function to search using the database FULLTEXT index on topic names and descriptions
+def _fulltext_search(search_item, limit):
+	conn = get_read_connection()
+	cur = conn.cursor()
+	if backend.dialect == 'sqlite':
+		# any of the words, each quoted so FTS5 does not read them as query syntax
+		match = ' OR '.join('"{}"'.format(word.replace('"', '""')) for word in search_item.split())
+		if not match:
+			conn.close()
+			return []
+		cur.execute(
+			'SELECT topics.* FROM topics_fts JOIN topics ON topics.id = topics_fts.rowid '
+			'WHERE topics_fts MATCH %s AND topics.deleted_at IS NULL ORDER BY topics_fts.rank LIMIT %s',
+			(match, FULLTEXT_CANDIDATE_LIMIT))
+	else:
+		cur.execute(
+			'SELECT * FROM topics WHERE MATCH (name, description) AGAINST (%s IN NATURAL LANGUAGE MODE) AND deleted_at IS NULL LIMIT %s',
+			(search_item, FULLTEXT_CANDIDATE_LIMIT))
+	candidates = read_topics(cur)
+	conn.close()
 
-		# this trend has already been added, must mean all the topics have been added
-		if topic_trends[highest_trend] <= 0: 
-			break
+	return rank_topics(candidates, search_item, limit)
+
+# Function to suggest topics for a partly typed or misspelled search term
+# the last word may be unfinished and every word may contain a typo or two depending on its length
+def suggest_topics(search_item, limit=SUGGESTION_LIMIT):
+	return topic_suggestions.suggest(search_item, limit)
+
+# Adds new posts to the running trending score of their topic
+# topic_trends.score holds ln(sum(e^(t/TRENDING_DECAY_SECONDS))) over the post times t of the topic,
+# so the decayed score at time now is e^(score - now/TRENDING_DECAY_SECONDS). Because the now term is
+# the same for every topic, ordering by the stored column is ordering by current score, and the
+# column can be indexed. The log-sum-exp form keeps the update from overflowing.
+# adding count posts at once adds ln(count) to the new term
+def _bump_trending_score(cur, topic_id, count=1):
+	if backend.dialect == 'sqlite':
+		cur.execute(
+			'INSERT INTO topic_trends (topic, score, updated) VALUES (%s, UNIX_TIMESTAMP() / %s + LN(%s), NOW()) '
+			'ON CONFLICT (topic) DO UPDATE SET '
+			' score = GREATEST(score, excluded.score) + LN(1 + EXP(-ABS(score - excluded.score))),'
+			' updated = excluded.updated',
+			(topic_id, TRENDING_DECAY_SECONDS, count))
+		return
+
+	cur.execute(
+		'INSERT INTO topic_trends (topic, score, updated) VALUES (%s, UNIX_TIMESTAMP() / %s + LN(%s), NOW()) '
+		'ON DUPLICATE KEY UPDATE '
+		' score = GREATEST(score, VALUES(score)) + LN(1 + EXP(-ABS(score - VALUES(score)))),'
+		' updated = VALUES(updated)',
+		(topic_id, TRENDING_DECAY_SECONDS, count))
 
-		# add the highest trending topic
-		cur.execute('SELECT * FROM topics WHERE id=%s', (highest_trend,))
-		res.append(cur.fetchone())
+# Function to order topics based on how recently there have been discussions in them
+# Scores are maintained by add_post, so this is a read of the top rows of the topic_trends score index
+def order_trending_topics(topic_count=TRENDING_TOPIC_COUNT):
+	conn = get_read_connection()
+	cur = conn.cursor()
+	cur.execute(
+		'SELECT topics.* FROM topic_trends JOIN topics ON topics.id = topic_trends.topic '
+		'WHERE topics.deleted_at IS NULL ORDER BY topic_trends.score DESC LIMIT %s',
+		(topic_count,))
+	topics = read_topics(cur)
+	conn.close()
 
-		# set the trend index to zero for this topic so it is not added again
-		topic_trends[highest_trend] = -1
+	return topics
 
+# Function to get the topics with the most recent posts, read from the index on topics.last_post_at
+def most_active_topics(topic_count):
+	conn = get_read_connection()
+	cur = conn.cursor()
+	cur.execute('SELECT * FROM topics WHERE last_post_at IS NOT NULL AND deleted_at IS NULL ORDER BY last_post_at DESC LIMIT %s', (topic_count,))
+	topics = read_topics(cur)
 	conn.close()
 
-	return res
+	return topics
 
 # Function to get the most recently created topics
 def recent_topics(topic_count):
-	conn = get_connection()
+	if topic_count > RECENT_TOPICS_CACHED:
+		return _load_recent_topics(topic_count)
+
+	topics = read_through(read_cache, 'recent_topics', _on_primary(lambda: _load_recent_topics(RECENT_TOPICS_CACHED)))
+	return topics[:topic_count]
+
+def _load_recent_topics(topic_count):
+	conn = get_read_connection()
 	cur = conn.cursor()
-	cur.execute('SELECT * FROM topics ORDER BY id DESC LIMIT %s',(topic_count,))
-	recent_topics = cur.fetchall()
+	cur.execute('SELECT * FROM topics WHERE deleted_at IS NULL ORDER BY id DESC LIMIT %s',(topic_count,))
+	recent_topics = read_topics(cur)
 	conn.close()
 
-	res=[]
-	for topic in recent_topics:
-		res.append(topic)
+	return recent_topics
+
+# Function to update the caches and search index after a topic was created, edited or deleted
+# topic is the new row, or None if the topic is gone
+def _topic_changed(topic_id, topic):
+	read_cache.delete('topic:{}'.format(topic_id))
+	hot_topics.invalidate(topic_id)
+	read_cache.delete('recent_topics')
+	if topic is None:
+		topic_index.remove(topic_id)
+	else:
+		topic_index.add(topic)
+	_notify_write('topic', topic_id)
+
+# functions called with (kind, topic id) after a write commits, kind is 'post' or 'topic'
+# lets caches outside this module, such as the page cache, invalidate what the write changed
+write_listeners = []
+
+# Function to register a function to be called after every committed write
+def add_write_listener(fn):
+	write_listeners.append(fn)
 
-	return res
+def _notify_write(kind, topic_id):
+	for fn in write_listeners:
+		fn(kind, topic_id)
@@ -0,0 +1,39 @@
+# asyncio variant of the data access functions in models.py
+# Every function has the same name and arguments as in models.py and returns a coroutine.
+# The blocking pymysql calls run on models.query_executor, a thread pool sized to the connection pool,
+# so an event loop (e.g. under an ASGI server) stays free and independent queries can overlap:
+#
+#	trending, recent = await asyncio.gather(order_trending_topics(), recent_topics(5))
+import asyncio
+import functools
+import models
+
+# Function to turn a blocking model function into a coroutine function that runs it on the executor
+def _offload(function):
+	@functools.wraps(function)
+	async def run(*args, **kwargs):
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(models.query_executor, functools.partial(function, *args, **kwargs))
+	return run
+
+# Function wrapping a function that returns an iterator, so the iterator is read to the end on the
+# executor and the coroutine returns a list
+def _collected(function):
+	@functools.wraps(function)
+	def collect(*args, **kwargs):
+		return list(function(*args, **kwargs))
+	return collect
+
+get_topics = _offload(_collected(models.get_topics))
+get_topics_page = _offload(models.get_topics_page)
+create_topic = _offload(models.create_topic)
+get_posts_in_topic = _offload(models.get_posts_in_topic)
+add_post = _offload(models.add_post)
+get_topic = _offload(models.get_topic)
+edit_topic = _offload(models.edit_topic)
+delete_topic = _offload(models.delete_topic)
+search_for = _offload(models.search_for)
+suggest_topics = _offload(models.suggest_topics)
+order_trending_topics = _offload(models.order_trending_topics)
+recent_topics = _offload(models.recent_topics)
+most_active_topics = _offload(models.most_active_topics)
@@ -0,0 +1,84 @@
+import functools
+import hashlib
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+from flask import request, session, make_response
+from cache import LRUCache, MISSING
+
+# Stored copy of a rendered page
+class _Page:
+	__slots__ = ('body', 'mimetype', 'etag', 'last_modified')
+
+	def __init__(self, body, mimetype, etag, last_modified):
+		self.body = body
+		self.mimetype = mimetype
+		self.etag = etag
+		self.last_modified = last_modified
+
+# Cache of whole responses to anonymous GET requests, keyed by path and query arguments
+# Every page is cached under tags (e.g. 'index', 'topic:3'); invalidating a tag drops every page
+# carrying it. Invalidation only reaches this instance, so ttl bounds how long another instance's
+# write can go unseen. Responses carry an ETag and Last-Modified, and a matching conditional request
+# gets a 304 without the page being rendered again.
+# bypass is an optional function returning True for requests that must neither be served from the
+# cache nor fill it
+class PageCache:
+	def __init__(self, max_entries=1024, ttl=30, bypass=None):
+		self._pages = LRUCache(max_entries=max_entries, ttl=ttl)
+		self._bypass = bypass
+		self._generations = {} # tag -> number of times it was invalidated, part of the cache key
+		self._lock = threading.Lock()
+		self.stats = self._pages.stats
+
+	# Decorator caching the GET responses of a view
+	# tags is a function taking the view arguments and returning the tags of the page
+	def cached(self, tags):
+		def decorator(view):
+			@functools.wraps(view)
+			def wrapper(*args, **kwargs):
+				# POST requests change things, and pages showing flashed messages are personal
+				if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+					return view(*args, **kwargs)
+				if self._bypass is not None and self._bypass():
+					return view(*args, **kwargs)
+
+				key = self._key(tags(*args, **kwargs))
+				page = self._pages.get(key)
+				if page is MISSING:
+					response = make_response(view(*args, **kwargs))
+					if response.status_code != 200 or response.headers.get('Set-Cookie') or response.is_streamed:
+						return response
+					page = self._store(key, response)
+
+				return self._respond(page)
+			return wrapper
+		return decorator
+
+	# Function to drop every cached page carrying one of the tags
+	def invalidate(self, *tags):
+		with self._lock:
+			for tag in tags:
+				self._generations[tag] = self._generations.get(tag, 0) + 1
+
+	def _key(self, tags):
+		args = urlencode(sorted(request.args.items(multi=True)))
+		with self._lock:
+			generations = ','.join('{}={}'.format(tag, self._generations.get(tag, 0)) for tag in tags)
+		return '{}?{}|{}'.format(request.path, args, generations)
+
+	def _store(self, key, response):
+		body = response.get_data()
+		etag = response.get_etag()[0] or hashlib.sha1(body).hexdigest()
+		page = _Page(body, response.mimetype, etag, datetime.now(timezone.utc).replace(microsecond=0))
+		self._pages.set(key, page)
+		return page
+
+	@staticmethod
+	def _respond(page):
+		response = make_response(page.body)
+		response.mimetype = page.mimetype
+		response.set_etag(page.etag)
+		response.last_modified = page.last_modified
+		response.cache_control.no_cache = True # browsers revalidate, which is answered with a 304
+		return response.make_conditional(request)
@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import deque
+
+SERVER_STATUS_IN_TRANS = 1 # pymysql server_status flag set while a transaction is open
+
+# Raised when no connection could be checked out before the checkout timeout
+class PoolTimeout(Exception):
+	pass
+
+# Connection handed out by the pool. It behaves like the underlying pymysql
+# connection, except that close() gives it back to the pool instead of closing it
+class PooledConnection:
+	def __init__(self, pool, conn):
+		self._pool = pool
+		self._conn = conn
+
+	def __getattr__(self, name):
+		if self._conn is None:
+			raise AttributeError('connection has already been returned to the pool')
+		return getattr(self._conn, name)
+
+	def close(self):
+		if self._conn is not None:
+			conn, self._conn = self._conn, None
+			self._pool.release(conn)
+
+	# a caller that never reached close() (e.g. an exception mid query) still returns the connection
+	def __del__(self):
+		try:
+			self.close()
+		except Exception:
+			pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		self.close()
+
+# Thread-safe pool of database connections
+# connect is a function that opens a new raw connection
+class ConnectionPool:
+	def __init__(self, connect, min_size=1, max_size=10, idle_timeout=300, checkout_timeout=10, ping_interval=30):
+		if max_size < 1 or min_size < 0 or min_size > max_size:
+			raise ValueError('invalid pool size: min_size={} max_size={}'.format(min_size, max_size))
+
+		self._connect = connect
+		self.min_size = min_size
+		self.max_size = max_size
+		self.idle_timeout = idle_timeout # seconds an idle connection is kept above min_size
+		self.checkout_timeout = checkout_timeout # seconds to wait for a free connection
+		self.ping_interval = ping_interval # connections idle longer than this are pinged before use
+
+		self._idle = deque() # (connection, time it was returned) pairs, most recently used at the right
+		self._size = 0 # connections currently open, idle or checked out
+		self._cond = threading.Condition()
+
+	# Function to check a connection out of the pool, opening a new one if there is room
+	def connect(self):
+		deadline = time.monotonic() + self.checkout_timeout
+
+		while True:
+			conn = None
+			with self._cond:
+				self._evict_idle()
+				while not self._idle and self._size >= self.max_size:
+					remaining = deadline - time.monotonic()
+					if remaining <= 0:
+						raise PoolTimeout('no database connection available after {} seconds'.format(self.checkout_timeout))
+					self._cond.wait(remaining)
+
+				if self._idle:
+					conn, idle_since = self._idle.pop()
+				else:
+					self._size += 1 # reserve the slot before connecting outside the lock
+
+			if conn is None:
+				try:
+					conn = self._connect()
+				except Exception:
+					self._discard()
+					raise
+				return PooledConnection(self, conn)
+
+			# only ping connections that sat idle long enough to have been dropped by the server
+			if time.monotonic() - idle_since < self.ping_interval or self._healthy(conn):
+				return PooledConnection(self, conn)
+
+			self._close_quietly(conn)
+			self._discard()
+
+	# Function to return a connection to the pool
+	def release(self, conn):
+		try:
+			# end any transaction left open so the next user does not see a stale snapshot
+			if conn.open and self._in_transaction(conn):
+				conn.rollback()
+		except Exception:
+			self._close_quietly(conn)
+			self._discard()
+			return
+
+		if not conn.open:
+			self._discard()
+			return
+
+		with self._cond:
+			self._idle.append((conn, time.monotonic()))
+			self._cond.notify()
+
+	# Function to close every idle connection, e.g. on shutdown
+	def close_all(self):
+		with self._cond:
+			while self._idle:
+				conn, _ = self._idle.popleft()
+				self._close_quietly(conn)
+				self._size -= 1
+			self._cond.notify_all()
+
+	# Function returning counters for monitoring
+	def stats(self):
+		with self._cond:
+			return {'size': self._size, 'idle': len(self._idle), 'max_size': self.max_size}
+
+	# close connections that have been idle too long, keeping at least min_size open
+	# must be called with the lock held
+	def _evict_idle(self):
+		now = time.monotonic()
+		while self._idle and self._size > self.min_size:
+			conn, idle_since = self._idle[0] # least recently used
+			if now - idle_since < self.idle_timeout:
+				break
+			self._idle.popleft()
+			self._close_quietly(conn)
+			self._size -= 1
+
+	@staticmethod
+	def _in_transaction(conn):
+		status = getattr(conn, 'server_status', None)
+		if status is None:
+			return True
+		return bool(status & SERVER_STATUS_IN_TRANS)
+
+	def _healthy(self, conn):
+		try:
+			conn.ping(reconnect=False)
+			return True
+		except Exception:
+			return False
+
+	def _discard(self):
+		with self._cond:
+			self._size -= 1
+			self._cond.notify()
+
+	@staticmethod
+	def _close_quietly(conn):
+		try:
+			conn.close()
+		except Exception:
+			pass
@@ -0,0 +1,49 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Background worker removing the posts of deleted topics in batches
+# pending returns the ids of topics waiting to be purged, purge_batch(topic id) deletes one batch of
+# their posts and returns how many it deleted, and finish(topic id) removes the topic once that is 0
+# Purges are read back from the database on every round, so one cut short by a crash or a restart
+# is picked up again, by this instance or another one
+class TopicPurger:
+	def __init__(self, pending, purge_batch, finish, pause=0.1, poll_interval=60):
+		self._pending = pending
+		self._purge_batch = purge_batch
+		self._finish = finish
+		self.pause = pause # seconds between batches
+		self.poll_interval = poll_interval # seconds between rounds when nothing wakes the worker
+		self._wake = threading.Event()
+		self._thread = None
+		self._lock = threading.Lock()
+
+	# Function to start the worker thread, it first resumes any purge left unfinished
+	def start(self):
+		with self._lock:
+			if self._thread is None:
+				self._thread = threading.Thread(target=self._run, daemon=True)
+				self._thread.start()
+
+	# Function to make the worker look for new purges now instead of at the next poll
+	def wake(self):
+		self.start()
+		self._wake.set()
+
+	# Function to run one round in the calling thread, purging every pending topic completely
+	def run_once(self):
+		for topic_id in self._pending():
+			while self._purge_batch(topic_id) > 0:
+				time.sleep(self.pause)
+			self._finish(topic_id)
+
+	def _run(self):
+		while True:
+			self._wake.clear()
+			try:
+				self.run_once()
+			except Exception:
+				logger.exception('purging deleted topics failed, retrying in %s seconds', self.poll_interval)
+			self._wake.wait(self.poll_interval)
@@ -0,0 +1,31 @@
+from concurrent.futures import wait
+
+# Runs the independent model calls of one request concurrently and joins them
+# Each call runs on the executor with its own pooled connection, so a page that needs several
+# queries waits for the slowest one instead of all of them in turn
+#
+#	with QueryBatch(query_executor) as batch:
+#		trending = batch.submit(order_trending_topics)
+#		recent = batch.submit(recent_topics, 5)
+#	trending.result(), recent.result()
+class QueryBatch:
+	def __init__(self, executor):
+		self._executor = executor
+		self._futures = []
+
+	# Function to start a call, returns a future holding its result
+	def submit(self, function, *args, **kwargs):
+		future = self._executor.submit(function, *args, **kwargs)
+		self._futures.append(future)
+		return future
+
+	# Function to wait for every call submitted so far
+	def join(self):
+		wait(self._futures)
+
+	def __enter__(self):
+		return self
+
+	# no call outlives the block, even when the block raised
+	def __exit__(self, exc_type, exc, tb):
+		self.join()
@@ -0,0 +1,12 @@
+import heapq
+
+# Function to select the k items with the highest key, best first
+# Ties keep the order the items came in, so earlier items win over later ones with the same key
+# Runs in O(n log k) using a bounded heap instead of sorting or repeatedly scanning for the maximum
+# k=None returns every item, fully sorted
+def top_k(items, k, key):
+	if k is None:
+		return sorted(items, key=key, reverse=True) # sorted is stable, so ties keep their order
+	if k <= 0:
+		return []
+	return heapq.nlargest(k, items, key=key) # nlargest breaks ties by input order like sorted
@@ -0,0 +1,61 @@
+# Row types returned by the data access functions in models.py
+# Plain classes with __slots__ rather than the driver's tuples, so the code and the templates read the
+# columns by name. Without a __dict__ a record is 8 bytes smaller than a tuple of the same values,
+# though the values take most of the memory of a row (see benchmarks/row_memory_benchmark.py).
+# The columns are in the order of SELECT * on their table.
+
+# A row of the topics table
+class Topic:
+	__slots__ = ('id', 'name', 'description', 'post_count', 'last_post_at', 'deleted_at')
+
+	def __init__(self, id, name, description, post_count=0, last_post_at=None, deleted_at=None):
+		self.id = id
+		self.name = name
+		self.description = description
+		self.post_count = post_count
+		self.last_post_at = last_post_at
+		self.deleted_at = deleted_at
+
+	def __eq__(self, other):
+		return isinstance(other, Topic) and _values(self) == _values(other)
+
+	def __repr__(self):
+		return 'Topic({})'.format(', '.join(repr(value) for value in _values(self)))
+
+# A row of the posts table
+class Post:
+	__slots__ = ('id', 'content', 'created', 'topic')
+
+	def __init__(self, id, content, created, topic):
+		self.id = id
+		self.content = content
+		self.created = created
+		self.topic = topic
+
+	def __eq__(self, other):
+		return isinstance(other, Post) and _values(self) == _values(other)
+
+	def __repr__(self):
+		return 'Post({})'.format(', '.join(repr(value) for value in _values(self)))
+
+# Function returning the column values of a record, in column order
+def _values(record):
+	return tuple(getattr(record, name) for name in record.__slots__)
+
+# Function to read the topics a query returned, turning each row into a Topic as it is fetched
+def read_topics(cur):
+	return [Topic(*row) for row in cur]
+
+# Function to read the one topic a query returned, or None
+def read_topic(cur):
+	row = cur.fetchone()
+	return None if row is None else Topic(*row)
+
+# Function to read the posts a query returned, turning each row into a Post as it is fetched
+def read_posts(cur):
+	return [Post(*row) for row in cur]
+
+# Function to read the one post a query returned, or None
+def read_post(cur):
+	row = cur.fetchone()
+	return None if row is None else Post(*row)
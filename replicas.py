@@ -0,0 +1,89 @@
+import logging
+import threading
+import time
+from pool import PoolTimeout
+
+logger = logging.getLogger(__name__)
+
+# Read replicas of the database, each with its own connection pool
+# A replica only serves reads while its replication lag is at most max_lag seconds. The lag is
+# measured on a connection from the replica at most once every check_interval seconds and cached in
+# between, so routing a read usually costs no extra query. A replica that cannot be reached is
+# skipped until its next check.
+# measure_lag is a function taking a connection and returning how many seconds the replica is
+# behind, or None if it is not replicating
+class ReplicaSet:
+	def __init__(self, pools, measure_lag, max_lag=5, check_interval=5):
+		if not pools:
+			raise ValueError('a replica set needs at least one replica')
+
+		self._pools = pools
+		self._measure_lag = measure_lag
+		self.max_lag = max_lag
+		self.check_interval = check_interval
+
+		self._lag = [None] * len(pools) # last measured lag of each replica, None if unknown or unreachable
+		self._checked_at = [None] * len(pools) # time of the last measurement
+		self._next = 0 # replica the next read starts at, reads are spread round robin
+		self._lock = threading.Lock()
+
+	# Function to check out a connection from a replica that is caught up
+	# Returns None when no replica can serve the read, the caller then reads from the primary
+	def connect(self):
+		with self._lock:
+			start = self._next
+			self._next = (self._next + 1) % len(self._pools)
+
+		for i in range(len(self._pools)):
+			conn = self._connect_to((start + i) % len(self._pools))
+			if conn is not None:
+				return conn
+		return None
+
+	# Function returning the last measured lag and the pool counters of every replica, for monitoring
+	def stats(self):
+		with self._lock:
+			lags = list(self._lag)
+		return [{'lag': lag, 'pool': pool.stats()} for lag, pool in zip(lags, self._pools)]
+
+	def _connect_to(self, index):
+		with self._lock:
+			checked_at = self._checked_at[index]
+			due = checked_at is None or time.monotonic() - checked_at >= self.check_interval
+			if not due and not self._caught_up(self._lag[index]):
+				return None
+
+		try:
+			conn = self._pools[index].connect()
+		except PoolTimeout:
+			return None # busy rather than broken, the next replica or the primary takes the read
+		except Exception:
+			logger.exception('connecting to replica %d failed, reading elsewhere until its next check', index)
+			self._record(index, None)
+			return None
+
+		if not due:
+			return conn
+
+		try:
+			lag = self._measure_lag(conn)
+		except Exception:
+			# e.g. the database user lacks the REPLICATION CLIENT privilege, the replica never serves reads then
+			logger.exception('measuring the lag of replica %d failed, reading elsewhere until its next check', index)
+			conn.close()
+			self._record(index, None)
+			return None
+
+		self._record(index, lag)
+		if self._caught_up(lag):
+			return conn
+		conn.close()
+		return None
+
+	def _record(self, index, lag):
+		with self._lock:
+			self._lag[index] = lag
+			self._checked_at[index] = time.monotonic()
+
+	def _caught_up(self, lag):
+		return lag is not None and lag <= self.max_lag
@@ -0,0 +1,185 @@
+import re
+import threading
+import time
+from collections import defaultdict
+from ranking import top_k
+
+# Function to split text into the lowercase words that search compares
+def tokenize(text):
+	return text.lower().split()
+
+# Function to score how similar a topic name is to a search term
+# every topic word j that equals search word k adds (10-k)*(10-j), so matches early in both count the most
+def similarity(topic_words, search_words):
+	score = 0
+	for j in range(len(topic_words)):
+		for k in range(len(search_words)):
+			if topic_words[j] == search_words[k]:
+				score += (10-k)*(10-j)
+	return score
+
+# Function to rank candidate topics by similarity to the search term, most similar first
+# the name counts first, then how many of the search words the description contains, so topics
+# matching only in their description (as the fulltext candidates can) come after every name match
+# topics sharing no word with the search term in either are dropped
+def rank_topics(topics, search_item, limit=None):
+	search_words = tokenize(search_item)
+	query_words = set(re.findall(r'\w+', search_item.lower())) # without punctuation, like the fulltext tokenizers
+	matches = []
+	for topic in topics:
+		name_score = similarity(tokenize(topic.name), search_words)
+		description_words = set(re.findall(r'\w+', topic.description.lower()))
+		description_score = sum(1 for word in query_words if word in description_words)
+		if name_score > 0 or description_score > 0:
+			matches.append(((name_score, description_score), topic))
+
+	ranked = top_k(matches, limit, key=lambda match: (match[0], -match[1].id))
+	return [topic for score, topic in ranked]
+
+# In-process inverted index over topic names
+# Maps every word to the topics whose name contains it and the positions it appears at,
+# so a search only looks at topics that share a word with the search term
+class SearchIndex:
+	# load_topics is a function returning an iterable of every topic, as records.Topic
+	# the index is rebuilt in the background once it is older than max_age seconds,
+	# which picks up topics changed by other instances of the app
+	def __init__(self, load_topics, max_age=300):
+		self._load_topics = load_topics
+		self.max_age = max_age
+
+		self._postings = {} # word -> {topic id: [positions of the word in the topic name]}
+		self._topics = {} # topic id -> topic row
+		self._built_at = None
+		self._changes = None # changes made while a build is loading topics, replayed onto the new index
+		self.version = 0 # bumped on every change, lets structures derived from the index know to rebuild
+
+		self._lock = threading.Lock() # guards the structures above
+		self._build_lock = threading.Lock() # only one build runs at a time
+		self._rebuilding = False
+
+	# Function to (re)build the whole index from the database
+	def build(self):
+		with self._build_lock:
+			self._build_locked()
+
+	# Function to start building the index on a background thread, e.g. at startup
+	def build_in_background(self):
+		with self._lock:
+			if self._rebuilding:
+				return
+			self._rebuilding = True
+		threading.Thread(target=self._background_build, daemon=True).start()
+
+	# Function to add a new topic or replace an edited one
+	def add(self, topic):
+		with self._lock:
+			self._remove_locked(topic.id)
+			self._add_locked(topic)
+			if self._changes is not None:
+				self._changes.append((topic.id, topic))
+
+	# Function to drop a deleted topic
+	def remove(self, topic_id):
+		with self._lock:
+			self._remove_locked(topic_id)
+			if self._changes is not None:
+				self._changes.append((topic_id, None))
+
+	# Function returning the topics matching the search term, most similar first
+	def search(self, search_item, limit=None):
+		self.ensure_fresh()
+		search_words = tokenize(search_item)
+
+		with self._lock:
+			scores = defaultdict(int) # topic id -> similarity
+			for k in range(len(search_words)):
+				for topic_id, positions in self._postings.get(search_words[k], {}).items():
+					for j in positions:
+						scores[topic_id] += (10-k)*(10-j)
+
+			matches = [(score, self._topics[topic_id]) for topic_id, score in scores.items() if score > 0]
+
+		# ties go to the older topic, the order the topics table is read in
+		ranked = top_k(matches, limit, key=lambda match: (match[0], -match[1].id))
+		return [topic for score, topic in ranked]
+
+	# Function returning the index version and every indexed topic row
+	def snapshot(self):
+		self.ensure_fresh()
+		with self._lock:
+			return self.version, list(self._topics.values())
+
+	# Function returning the indexed rows of the topics with these ids, None for those not indexed
+	def current(self, topic_ids):
+		with self._lock:
+			return [self._topics.get(topic_id) for topic_id in topic_ids]
+
+	def ensure_fresh(self):
+		if self._built_at is None:
+			# nothing to serve yet, so build in the caller unless another thread got there first
+			with self._build_lock:
+				if self._built_at is None:
+					self._build_locked()
+		elif time.monotonic() - self._built_at > self.max_age:
+			self.build_in_background() # keep serving the current index meanwhile
+
+	def _background_build(self):
+		try:
+			self.build()
+		finally:
+			with self._lock:
+				self._rebuilding = False
+
+	# must be called with the build lock held
+	def _build_locked(self):
+		with self._lock:
+			self._changes = []
+
+		try:
+			postings = {}
+			topics = {}
+			for topic in self._load_topics():
+				topics[topic.id] = topic
+				self._index_words(postings, topic)
+		except Exception:
+			with self._lock:
+				self._changes = None
+			raise
+
+		with self._lock:
+			self._postings = postings
+			self._topics = topics
+			# the loaded rows may predate topics created, edited or deleted during the load
+			for topic_id, topic in self._changes:
+				self._remove_locked(topic_id)
+				if topic is not None:
+					self._add_locked(topic)
+			self._changes = None
+			self._built_at = time.monotonic()
+			self.version += 1
+
+	@staticmethod
+	def _index_words(postings, topic):
+		words = tokenize(topic.name)
+		for j in range(len(words)):
+			postings.setdefault(words[j], {}).setdefault(topic.id, []).append(j)
+
+	# must be called with the lock held
+	def _add_locked(self, topic):
+		self.version += 1
+		self._topics[topic.id] = topic
+		self._index_words(self._postings, topic)
+
+	# must be called with the lock held
+	def _remove_locked(self, topic_id):
+		topic = self._topics.pop(topic_id, None)
+		if topic is None:
+			return
+		self.version += 1
+		for word in set(tokenize(topic.name)):
+			topic_postings = self._postings.get(word)
+			if topic_postings is None:
+				continue
+			topic_postings.pop(topic_id, None)
+			if not topic_postings:
+				del self._postings[word]
@@ -0,0 +1,179 @@
+import math
+import sqlite3
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+import pymysql
+import pymysql.cursors
+from pymysql.constants import ER
+
+# Storage backends the data layer in models.py can run on
+# A backend opens raw connections for the pool and hides what the database driver does differently:
+# its IntegrityError, how a duplicate key is reported, how far a read replica is behind, how to read
+# a large result without buffering it and which SQL dialect it speaks (dialect).
+# Statements whose syntax differs between the dialects are kept side by side in models.py.
+
+# MySQL through pymysql, the Google Cloud SQL database in production
+class MySQLBackend:
+	dialect = 'mysql'
+	IntegrityError = pymysql.err.IntegrityError
+
+	# connect_args are passed to pymysql.connect
+	def __init__(self, **connect_args):
+		self.connect_args = connect_args
+		self._replica_status = 'SHOW REPLICA STATUS' # MySQL 8.0.22 and later, see replication_lag
+
+	def connect(self):
+		return pymysql.connect(**self.connect_args)
+
+	def is_duplicate(self, error):
+		return error.args[0] == ER.DUP_ENTRY
+
+	# Function returning a cursor that fetches rows from the server as they are read instead of
+	# buffering the whole result, the connection can run nothing else until every row is read
+	def streaming_cursor(self, conn):
+		return conn.cursor(pymysql.cursors.SSCursor)
+
+	# Function returning how many seconds the replica behind conn is behind its primary
+	# None while replication is stopped. A server that is not a replica at all (e.g. a local
+	# stand-in) has nothing to catch up on.
+	# Asks with SHOW REPLICA STATUS, and with SHOW SLAVE STATUS from then on if the server is older
+	# than MySQL 8.0.22 and does not know it (MySQL 8.4 in turn only knows SHOW REPLICA STATUS)
+	def replication_lag(self, conn):
+		cur = conn.cursor(pymysql.cursors.DictCursor)
+		try:
+			try:
+				cur.execute(self._replica_status)
+			except pymysql.err.ProgrammingError as e:
+				if e.args[0] != ER.PARSE_ERROR or self._replica_status == 'SHOW SLAVE STATUS':
+					raise
+				self._replica_status = 'SHOW SLAVE STATUS'
+				cur.execute(self._replica_status)
+			status = cur.fetchone()
+		finally:
+			cur.close()
+
+		if status is None:
+			return 0
+		if 'Seconds_Behind_Source' in status:
+			return status['Seconds_Behind_Source']
+		return status['Seconds_Behind_Master']
+
+# A single SQLite database file, for a single node deployment and for local runs and load tests
+# without a Cloud SQL proxy. The connections are set up for concurrent use:
+#   - WAL journaling, so readers are not blocked by the writer and the writer not by readers
+#   - synchronous=NORMAL, which is durable across application crashes with WAL (a power loss
+#     can lose the last transactions but does not corrupt the database)
+#   - a busy timeout, so a writer waits for another writer instead of failing straight away
+#   - a larger page cache and memory mapped reads
+# Compiled statements are kept per connection by the sqlite3 module and reused for the same SQL text.
+class SQLiteBackend:
+	dialect = 'sqlite'
+	IntegrityError = sqlite3.IntegrityError
+
+	PRAGMAS = (
+		'PRAGMA journal_mode=WAL',
+		'PRAGMA synchronous=NORMAL',
+		'PRAGMA busy_timeout=5000',
+		'PRAGMA cache_size=-65536', # 64 MB
+		'PRAGMA mmap_size=268435456', # 256 MB
+		'PRAGMA temp_store=MEMORY',
+	)
+
+	# schema is a file of CREATE ... IF NOT EXISTS statements run when the backend is first used
+	def __init__(self, path, schema=None, cached_statements=256):
+		self.path = path
+		self.schema = schema
+		self.cached_statements = cached_statements
+		self._initialized = False
+
+	def connect(self):
+		conn = sqlite3.connect(
+			self.path,
+			detect_types=sqlite3.PARSE_DECLTYPES,
+			check_same_thread=False, # the pool hands a connection to one thread at a time
+			cached_statements=self.cached_statements,
+		)
+		for pragma in self.PRAGMAS:
+			conn.execute(pragma)
+		_register_mysql_functions(conn)
+
+		if not self._initialized and self.schema:
+			with open(self.schema) as schema:
+				conn.executescript(schema.read())
+			self._initialized = True
+
+		return SQLiteConnection(conn)
+
+	def is_duplicate(self, error):
+		return 'UNIQUE constraint failed' in str(error)
+
+	# sqlite cursors already step through a result one row at a time
+	def streaming_cursor(self, conn):
+		return conn.cursor()
+
+	# a sqlite file has no replication, a second file standing in for a replica is never behind
+	def replication_lag(self, conn):
+		return 0
+
+# sqlite3 connection that accepts the %s placeholders used by the pymysql queries
+class SQLiteConnection:
+	def __init__(self, conn):
+		self._conn = conn
+		self.open = True
+
+	def cursor(self):
+		return SQLiteCursor(self._conn.cursor())
+
+	def commit(self):
+		self._conn.commit()
+
+	def rollback(self):
+		self._conn.rollback()
+
+	def ping(self, reconnect=False):
+		self._conn.execute('SELECT 1')
+
+	def close(self):
+		self.open = False
+		self._conn.close()
+
+class SQLiteCursor:
+	def __init__(self, cur):
+		self._cur = cur
+
+	def execute(self, query, args=()):
+		return self._cur.execute(_placeholders(query), args or ())
+
+	def executemany(self, query, args):
+		return self._cur.executemany(_placeholders(query), args)
+
+	def __getattr__(self, name):
+		return getattr(self._cur, name)
+
+	def __iter__(self):
+		return iter(self._cur)
+
+# Function to rewrite the %s placeholders of a query to sqlite's ?
+# cached, so the same query always becomes the same string and sqlite reuses its compiled statement
+@lru_cache(maxsize=512)
+def _placeholders(query):
+	return query.replace('%s', '?').replace('%%', '%')
+
+# Function to give a sqlite connection the MySQL functions the queries use
+def _register_mysql_functions(conn):
+	conn.create_function('NOW', 0, _utc_now)
+	conn.create_function('UNIX_TIMESTAMP', 0, time.time)
+	conn.create_function('LN', 1, math.log)
+	conn.create_function('EXP', 1, math.exp)
+	conn.create_function('GREATEST', -1, max)
+
+# same format as the timestamps sqlite writes for CURRENT_TIMESTAMP
+def _utc_now():
+	return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+# read TIMESTAMP columns back as datetimes like pymysql does
+def _convert_timestamp(value):
+	return datetime.strptime(value.decode()[:19], '%Y-%m-%d %H:%M:%S')
+
+sqlite3.register_converter('TIMESTAMP', _convert_timestamp)
@@ -0,0 +1,205 @@
+# Read replica routing, run against two local SQLite files standing in for replicas
+# Run from the repository root: python -m pytest tests
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'lib')] # the vendored libraries, as on app engine
+
+import pymysql
+from pool import ConnectionPool
+from replicas import ReplicaSet
+from storage import MySQLBackend, SQLiteBackend
+
+SCHEMA = os.path.join(ROOT, 'migrations', 'sqlite_schema.sql')
+
+# Function to create a database file holding one topic named after it, so a read shows where it went
+def make_database(directory, name):
+	backend = SQLiteBackend(os.path.join(directory, name + '.db'), schema=SCHEMA)
+	conn = backend.connect()
+	cur = conn.cursor()
+	cur.execute('INSERT INTO topics (name, description) VALUES (%s, %s)', (name, name))
+	conn.commit()
+	conn.close()
+	return backend
+
+# Function returning the name of the topic in the database behind conn
+def database_of(conn):
+	cur = conn.cursor()
+	cur.execute('SELECT name FROM topics ORDER BY id LIMIT 1')
+	return cur.fetchone()[0]
+
+# Function returning which database a connection checked out from replicas reads, None for none
+def read_from(replicas):
+	conn = replicas.connect()
+	if conn is None:
+		return None
+	name = database_of(conn)
+	conn.close()
+	return name
+
+class ReplicaSetTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.lags = {'first': 0, 'second': 0} # lag each replica reports, an exception is raised instead
+		self.pools = [ConnectionPool(make_database(self.directory.name, name).connect) for name in self.lags]
+		self.replicas = ReplicaSet(self.pools, self.measure_lag, max_lag=5, check_interval=0)
+
+	def tearDown(self):
+		for pool in self.pools:
+			pool.close_all()
+		self.directory.cleanup()
+
+	def measure_lag(self, conn):
+		lag = self.lags[database_of(conn)]
+		if isinstance(lag, Exception):
+			raise lag
+		return lag
+
+	def test_reads_are_spread_over_the_replicas(self):
+		reads = [read_from(self.replicas) for i in range(4)]
+		self.assertEqual(reads, ['first', 'second', 'first', 'second'])
+
+	def test_lagging_replica_is_skipped(self):
+		self.lags['first'] = 60
+		reads = [read_from(self.replicas) for i in range(4)]
+		self.assertEqual(reads, ['second'] * 4)
+
+	def test_no_replica_when_all_lag(self):
+		self.lags['first'] = self.lags['second'] = 60
+		self.assertIsNone(read_from(self.replicas))
+		self.assertEqual([replica['lag'] for replica in self.replicas.stats()], [60, 60])
+
+	def test_lag_is_cached_between_checks(self):
+		self.replicas.check_interval = 60
+		self.lags['first'] = 60
+		self.assertEqual(read_from(self.replicas), 'second')
+		self.lags['first'] = 0 # not measured again before the next check
+		reads = [read_from(self.replicas) for i in range(2)]
+		self.assertEqual(reads, ['second', 'second'])
+
+	def test_failed_lag_measurement_is_logged(self):
+		self.lags['first'] = RuntimeError('access denied; you need the REPLICATION CLIENT privilege')
+		with self.assertLogs('replicas', level='ERROR') as logs:
+			self.assertEqual(read_from(self.replicas), 'second')
+		self.assertIn('replica 0', logs.output[0])
+		self.assertIsNone(self.replicas.stats()[0]['lag'])
+
+# Cursor answering SHOW ... STATUS like a MySQL server of a given version
+class FakeStatusCursor:
+	def __init__(self, statements, status):
+		self._statements = statements # statements the server knows
+		self._status = status
+		self.executed = []
+
+	def execute(self, query):
+		self.executed.append(query)
+		if query not in self._statements:
+			raise pymysql.err.ProgrammingError(1064, 'You have an error in your SQL syntax')
+
+	def fetchone(self):
+		return self._status
+
+	def close(self):
+		pass
+
+class FakeConnection:
+	def __init__(self, cur):
+		self._cur = cur
+
+	def cursor(self, cursor_class=None):
+		return self._cur
+
+class MySQLReplicationLagTest(unittest.TestCase):
+	def test_replica_status(self):
+		cur = FakeStatusCursor(['SHOW REPLICA STATUS'], {'Seconds_Behind_Source': 3})
+		self.assertEqual(MySQLBackend().replication_lag(FakeConnection(cur)), 3)
+		self.assertEqual(cur.executed, ['SHOW REPLICA STATUS'])
+
+	def test_slave_status_before_mysql_8_0_22(self):
+		backend = MySQLBackend()
+		cur = FakeStatusCursor(['SHOW SLAVE STATUS'], {'Seconds_Behind_Master': 4})
+		self.assertEqual(backend.replication_lag(FakeConnection(cur)), 4)
+		self.assertEqual(backend.replication_lag(FakeConnection(cur)), 4)
+		self.assertEqual(cur.executed, ['SHOW REPLICA STATUS', 'SHOW SLAVE STATUS', 'SHOW SLAVE STATUS'])
+
+	def test_not_a_replica(self):
+		cur = FakeStatusCursor(['SHOW REPLICA STATUS'], None)
+		self.assertEqual(MySQLBackend().replication_lag(FakeConnection(cur)), 0)
+
+# The data layer configured with a primary and one replica file
+# models reads its configuration when it is imported, so it is only imported here
+class ReadYourWritesTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.directory = tempfile.TemporaryDirectory()
+		make_database(cls.directory.name, 'primary')
+		make_database(cls.directory.name, 'replica')
+		os.environ.update(
+			DB_BACKEND='sqlite',
+			SQLITE_PATH=os.path.join(cls.directory.name, 'primary.db'),
+			DB_REPLICAS=os.path.join(cls.directory.name, 'replica.db'),
+			READ_YOUR_WRITES_WINDOW='1',
+		)
+		import models
+		cls.models = models
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.directory.cleanup()
+
+	# Function running fn as a request of a client whose session holds session_values
+	# returns what fn returned and the session the client gets back
+	def in_request(self, fn, **session_values):
+		from flask import Flask, session
+		app = Flask(__name__)
+		app.config['SECRET_KEY'] = 'test'
+		with app.test_request_context('/'):
+			session.update(session_values)
+			self.models.begin_request()
+			try:
+				result = fn()
+				self.models.commit_request()
+			finally:
+				self.models.end_request()
+			return result, dict(session)
+
+	def first_topic_name(self):
+		topics, next_cursor = self.models.get_topics_page(1)
+		return topics[0].name
+
+	def test_reads_go_to_the_replica(self):
+		name, session = self.in_request(self.first_topic_name)
+		self.assertEqual(name, 'replica')
+
+	def test_client_that_wrote_reads_from_the_primary(self):
+		def write_then_read():
+			self.models.create_topic('written {}'.format(time.time()), 'x')
+			return self.first_topic_name()
+
+		name, session = self.in_request(write_then_read)
+		self.assertEqual(name, 'primary') # the rest of the writing request
+		name, session = self.in_request(self.first_topic_name, **session)
+		self.assertEqual(name, 'primary') # the next request of the same client
+
+		time.sleep(1.1) # READ_YOUR_WRITES_WINDOW
+		name, session = self.in_request(self.first_topic_name, **session)
+		self.assertEqual(name, 'replica')
+
+	def test_lagging_replica_falls_back_to_the_primary(self):
+		replica_set = self.models.replica_set
+		measure_lag = replica_set._measure_lag
+		replica_set._measure_lag = lambda conn: 60
+		replica_set._checked_at = [None]
+		try:
+			name, session = self.in_request(self.first_topic_name)
+		finally:
+			replica_set._measure_lag = measure_lag
+			replica_set._checked_at = [None]
+		self.assertEqual(name, 'primary')
+
+if __name__ == '__main__':
+	unittest.main()
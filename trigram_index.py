@@ -0,0 +1,208 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from search_index import tokenize
+
+# Function returning the trigrams of a word, padded so the start and end of the word count too
+def trigrams(word):
+	padded = '  ' + word + ' '
+	return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+# Function returning the largest number of typos tolerated in a word of this length
+def max_edits(word):
+	if len(word) < 4:
+		return 0
+	if len(word) < 7:
+		return 1
+	return 2
+
+# Function returning the edit distance between a and b, or None once it is known to exceed limit
+# swapping two neighbouring letters counts as a single edit
+def bounded_edit_distance(a, b, limit):
+	if abs(len(a) - len(b)) > limit:
+		return None
+
+	before_previous = None
+	previous = list(range(len(b) + 1))
+	for i in range(1, len(a) + 1):
+		current = [i] + [0]*len(b)
+		for j in range(1, len(b) + 1):
+			cost = 0 if a[i-1] == b[j-1] else 1
+			current[j] = min(previous[j] + 1, current[j-1] + 1, previous[j-1] + cost)
+			if i > 1 and j > 1 and a[i-1] == b[j-2] and a[i-2] == b[j-1]:
+				current[j] = min(current[j], before_previous[j-2] + 1)
+		if min(current) > limit: # every path through this row is already too expensive
+			return None
+		before_previous, previous = previous, current
+
+	if previous[-1] > limit:
+		return None
+	return previous[-1]
+
+# Immutable arrays built from one version of the topics
+# Words are stored once, sorted, and referred to by their position in that list
+class _Snapshot:
+	def __init__(self, version, topics):
+		self.version = version
+		self.built_at = time.monotonic()
+		self.topics = sorted(topics, key=lambda topic: topic.id)
+
+		topic_words = {} # word -> topic positions in self.topics
+		for i in range(len(self.topics)):
+			for word in set(tokenize(self.topics[i].name)):
+				topic_words.setdefault(word, []).append(i)
+
+		self.words = sorted(topic_words)
+
+		# topics containing word w are word_topics[word_offsets[w]:word_offsets[w+1]]
+		self.word_offsets = array('I', [0])
+		self.word_topics = array('I')
+		gram_words = {}
+		for w in range(len(self.words)):
+			self.word_topics.extend(topic_words[self.words[w]])
+			self.word_offsets.append(len(self.word_topics))
+			for gram in trigrams(self.words[w]):
+				gram_words.setdefault(gram, []).append(w)
+
+		# words containing trigram g are gram_postings[start:end] where (start, end) = gram_ranges[g]
+		self.gram_ranges = {}
+		self.gram_postings = array('I')
+		for gram, words in gram_words.items():
+			start = len(self.gram_postings)
+			self.gram_postings.extend(words)
+			self.gram_ranges[gram] = (start, len(self.gram_postings))
+
+	def topics_of(self, w):
+		return self.word_topics[self.word_offsets[w]:self.word_offsets[w+1]]
+
+# In-process trigram index over the words of topic names for autocomplete
+# Finds words that extend the last (possibly unfinished) word of the query and words within a
+# small edit distance of each query word, so topics can be suggested while the user types or misspells
+# It is derived from the SearchIndex topics and rebuilt once that index has changed, at most once every
+# rebuild_interval seconds since a rebuild holds the interpreter for a while on a large table. Until then
+# topics deleted or renamed since the last rebuild are left out of the suggestions and new ones are missing.
+class TrigramIndex:
+	# budget is the number of seconds a query may spend before returning what it has found so far
+	def __init__(self, search_index, budget=0.05, prefix_scan_limit=1000, rebuild_interval=60):
+		self._search_index = search_index
+		self.budget = budget
+		self.prefix_scan_limit = prefix_scan_limit # most words a single prefix may expand to
+		self.rebuild_interval = rebuild_interval
+		self._snapshot = None
+		self._build_lock = threading.Lock()
+
+	# Function returning up to limit topics matching the query, best first
+	# every query word must match a word of the topic name, exactly, by prefix (last word only) or with a typo
+	def suggest(self, query, limit=10):
+		deadline = time.monotonic() + self.budget
+		snapshot = self._current_snapshot()
+		query_words = tokenize(query)
+		if not query_words:
+			return []
+
+		costs = None # topic position -> summed match cost over the query words processed so far
+		for i in range(len(query_words)):
+			is_last = i == len(query_words) - 1
+			word_costs = self._match_word(snapshot, query_words[i], is_last, deadline)
+
+			topic_costs = {}
+			for w, cost in word_costs.items():
+				for t in snapshot.topics_of(w):
+					if costs is not None and t not in costs:
+						continue
+					if t not in topic_costs or cost < topic_costs[t]:
+						topic_costs[t] = cost
+
+			if costs is not None:
+				topic_costs = {t: cost + costs[t] for t, cost in topic_costs.items()}
+			costs = topic_costs
+			if not costs:
+				return []
+
+		ranked = sorted(costs.items(), key=lambda item: (item[1], item[0]))
+		return self._still_current(snapshot, [t for t, cost in ranked], limit)
+
+	# Function returning the first limit of the snapshot topics at positions that are still in the
+	# search index under the same name, as the index holds them now
+	def _still_current(self, snapshot, positions, limit):
+		suggestions = []
+		for start in range(0, len(positions), limit):
+			topics = [snapshot.topics[t] for t in positions[start:start + limit]]
+			current = self._search_index.current([topic.id for topic in topics])
+			for topic, now in zip(topics, current):
+				if now is not None and now.name == topic.name:
+					suggestions.append(now)
+			if len(suggestions) >= limit:
+				break
+		return suggestions[:limit]
+
+	# Function returning word position -> cost for the indexed words matching one query word
+	# exact matches cost 0, prefix extensions 1, and each typo 2
+	def _match_word(self, snapshot, query_word, allow_prefix, deadline):
+		words = snapshot.words
+		matches = {}
+
+		start = bisect_left(words, query_word)
+		if start < len(words) and words[start] == query_word:
+			matches[start] = 0
+
+		if allow_prefix:
+			w = start
+			while w < len(words) and w - start < self.prefix_scan_limit and words[w].startswith(query_word):
+				matches.setdefault(w, 1)
+				w += 1
+
+		limit = max_edits(query_word)
+		if limit == 0:
+			return matches
+
+		# one edit changes at most 3 trigrams of a word, and swapping two letters at most 4,
+		# so a word within `limit` edits shares all but at most 4*limit of the query word's trigrams
+		grams = trigrams(query_word)
+		shared = {}
+		for gram in grams:
+			if gram in snapshot.gram_ranges:
+				gram_start, gram_end = snapshot.gram_ranges[gram]
+				for w in snapshot.gram_postings[gram_start:gram_end]:
+					shared[w] = shared.get(w, 0) + 1
+		required = max(1, len(grams) - 4*limit)
+
+		for w, count in shared.items():
+			if time.monotonic() > deadline:
+				break
+			if count < required or w in matches:
+				continue
+			distance = bounded_edit_distance(query_word, words[w], limit)
+			if distance is not None:
+				matches[w] = 2*distance
+
+		return matches
+
+	def _current_snapshot(self):
+		self._search_index.ensure_fresh()
+		snapshot = self._snapshot
+
+		if snapshot is None:
+			# nothing to answer from yet, so build in the caller
+			with self._build_lock:
+				if self._snapshot is None:
+					self._build()
+			return self._snapshot
+
+		# rebuild on a background thread and keep answering from the previous snapshot meanwhile
+		due = time.monotonic() - snapshot.built_at >= self.rebuild_interval
+		if due and snapshot.version != self._search_index.version and self._build_lock.acquire(blocking=False):
+			threading.Thread(target=self._background_build, daemon=True).start()
+		return snapshot
+
+	def _build(self):
+		version, topics = self._search_index.snapshot()
+		self._snapshot = _Snapshot(version, topics)
+
+	# runs with the build lock acquired by the thread that started it
+	def _background_build(self):
+		try:
+			self._build()
+		finally:
+			self._build_lock.release()
@@ -0,0 +1,57 @@
+# Connection shared by every model call of one unit of work, e.g. one request
+# close() leaves the connection open for the next call and commit() is deferred until the unit of work commits
+class SharedConnection:
+	def __init__(self, unit_of_work, conn):
+		self._unit_of_work = unit_of_work
+		self._conn = conn
+
+	def __getattr__(self, name):
+		return getattr(self._conn, name)
+
+	def commit(self):
+		self._unit_of_work.has_writes = True
+
+	def close(self):
+		pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		pass
+
+# Checks out at most one connection and commits everything written through it in one transaction
+# checkout is a function returning a pooled connection
+class UnitOfWork:
+	def __init__(self, checkout):
+		self._checkout = checkout
+		self._conn = None
+		self._after_commit = [] # functions to run once the transaction has committed
+		self.has_writes = False # set once a model call asked to commit
+
+	# Function returning the shared connection, checking it out on first use
+	def connection(self):
+		if self._conn is None:
+			self._conn = self._checkout()
+		return SharedConnection(self, self._conn)
+
+	# Function to run fn after the transaction commits, or never if it is rolled back
+	def after_commit(self, fn):
+		self._after_commit.append(fn)
+
+	# Function to commit the writes of the unit of work and run the functions waiting for that
+	def commit(self):
+		if self._conn is not None and self.has_writes:
+			self._conn.commit()
+		self.has_writes = False
+
+		callbacks, self._after_commit = self._after_commit, []
+		for fn in callbacks:
+			fn()
+
+	# Function to give the connection back, rolling back anything not committed
+	def close(self):
+		self._after_commit = []
+		if self._conn is not None:
+			conn, self._conn = self._conn, None
+			conn.close()
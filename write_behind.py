@@ -0,0 +1,85 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Write-behind queue that collects items and hands them to write_batch in batches on a background thread
+# A batch is written once it holds max_batch items or its oldest item has waited max_delay seconds
+#
+# Durability: queued items only live in the memory of this process. Anything still queued when the
+# process dies is lost, so at most max_queue items, normally those of the last max_delay seconds.
+# flush() writes everything queued and is registered to run when the process exits normally.
+class WriteBehindQueue:
+	def __init__(self, write_batch, write_one, max_batch=100, max_delay=0.05, max_queue=10000):
+		self._write_batch = write_batch # writes a list of items in one go
+		self._write_one = write_one # writes a single item, used when a batch fails
+		self.max_batch = max_batch
+		self.max_delay = max_delay
+		self._queue = queue.Queue(maxsize=max_queue)
+		self._thread = None
+		self._lock = threading.Lock()
+
+	# Function to queue an item for writing
+	# Returns False when the queue is full, in which case the caller should write it synchronously
+	def submit(self, item):
+		self._start()
+		try:
+			self._queue.put_nowait(item)
+			return True
+		except queue.Full:
+			return False
+
+	# Function to write everything queued so far in the calling thread
+	def flush(self):
+		batch = []
+		while True:
+			try:
+				batch.append(self._queue.get_nowait())
+			except queue.Empty:
+				break
+			if len(batch) >= self.max_batch:
+				self._write(batch)
+				batch = []
+		if batch:
+			self._write(batch)
+
+	def pending(self):
+		return self._queue.qsize()
+
+	def _start(self):
+		if self._thread is not None:
+			return
+		with self._lock:
+			if self._thread is None:
+				self._thread = threading.Thread(target=self._run, daemon=True)
+				self._thread.start()
+
+	def _run(self):
+		while True:
+			batch = [self._queue.get()] # wait for the first item of a batch
+			deadline = time.monotonic() + self.max_delay
+			while len(batch) < self.max_batch:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					break
+				try:
+					batch.append(self._queue.get(timeout=remaining))
+				except queue.Empty:
+					break
+			self._write(batch)
+
+	def _write(self, batch):
+		try:
+			self._write_batch(batch)
+			return
+		except Exception:
+			logger.exception('writing a batch of %d items failed, retrying them one at a time', len(batch))
+
+		# one bad item should not cost the rest of the batch
+		for item in batch:
+			try:
+				self._write_one(item)
+			except Exception:
+				logger.exception('dropping queued item %r', item)